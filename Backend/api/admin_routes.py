@@ -0,0 +1,71 @@
+from fastapi import APIRouter, Header, HTTPException
+from fastapi.responses import FileResponse
+from typing import Optional
+from services import identity_cache, profiling
+from services.data_access import db
+from services.supabase_recording import RecordedSupabase
+import logging
+import os
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+
+def require_token(token: Optional[str]) -> None:
+    if not profiling.token_valid(token):
+        raise HTTPException(status_code=403, detail="Admin token missing or invalid.")
+
+
+@router.post("/admin/profile/window")
+def start_profile_window(seconds: float = 30, mode: str = "sampling", x_profile_token: Optional[str] = Header(None)):
+    """
+    Profiles every request for the next `seconds` (at most 600), in either
+    "sampling" or "cprofile" mode.
+    """
+    require_token(x_profile_token)
+    if mode not in profiling.PROFILE_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {list(profiling.PROFILE_MODES)}")
+    until = profiling.enable_window(min(seconds, 600), mode)
+    logger.info(f"Profiling window opened for {seconds}s in {mode} mode")
+    return {"mode": mode, "until": until}
+
+
+@router.get("/admin/profile")
+def list_profiles(x_profile_token: Optional[str] = Header(None)):
+    """Lists saved profiles, newest first."""
+    require_token(x_profile_token)
+    files = []
+    for subdir in ("on-demand", "slow"):
+        directory = os.path.join(profiling.PROFILE_DIR, subdir)
+        if not os.path.isdir(directory):
+            continue
+        for name in os.listdir(directory):
+            stat = os.stat(os.path.join(directory, name))
+            files.append({"kind": subdir, "name": name, "bytes": stat.st_size, "modified": stat.st_mtime})
+    return sorted(files, key=lambda f: f["modified"], reverse=True)
+
+
+@router.get("/admin/profile/{kind}/{name}")
+def download_profile(kind: str, name: str, x_profile_token: Optional[str] = Header(None)):
+    require_token(x_profile_token)
+    if kind not in ("on-demand", "slow") or os.path.basename(name) != name:
+        raise HTTPException(status_code=404, detail="Profile not found.")
+    path = os.path.join(profiling.PROFILE_DIR, kind, name)
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Profile not found.")
+    return FileResponse(path, filename=name)
+
+
+@router.get("/admin/stats")
+def cache_stats(x_profile_token: Optional[str] = Header(None)):
+    """Identity cache counters, Supabase gateway counters and, under replay, stand-in hits and misses."""
+    require_token(x_profile_token)
+    stats = {
+        "identity_cache": identity_cache.stats(),
+        "supabase": {**db.stats, "circuit": db.breaker.state},
+    }
+    if isinstance(db.client, RecordedSupabase):
+        stats["supabase_standin"] = dict(db.client.stats)
+    return stats
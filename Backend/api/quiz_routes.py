@@ -1,6 +1,8 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from services import recommendation_service
-from services.supabase_client import supabase
+from services.payload_cache import PrecomputedPayload
+from services.profiling import profiled
+from services import identity_cache
 from models.schemas import QuizImage, UserRequest, InitialQuizSubmission, RefineTasteRequest
 import logging
 
@@ -10,26 +12,34 @@ router = APIRouter()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# The initial quiz is identical for every user, so it is served from
+# pre-serialized bytes that are only rebuilt when the table version changes.
+initial_quiz_payload = PrecomputedPayload(
+    name="initial_quiz",
+    build=lambda: [image.dict() for image in recommendation_service.get_initial_quiz_from_supabase()],
+    version_probe=recommendation_service.get_initial_quiz_version,
+)
+
 @router.get("/quiz/initial", response_model=list[QuizImage])
-def get_initial_quiz_route():
+@profiled
+def get_initial_quiz_route(request: Request):
     try:
-        images = recommendation_service.get_initial_quiz_from_supabase()
-        return images
+        return initial_quiz_payload.respond(request)
     except Exception as e:
         logger.error(f"Failed to fetch initial quiz: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to fetch initial quiz: {str(e)}")
 
 @router.post("/quiz/initial")
+@profiled
 def submit_initial_quiz_route(request: InitialQuizSubmission):
     try:
         logger.info(f"Submitting quiz for user_id: {request.user_id}")
-        user_response = supabase.table("users").select("id").eq("id", request.user_id).execute()
-        if not user_response.data:
+        if not identity_cache.user_exists(request.user_id):
             logger.error(f"User not found for user_id: {request.user_id}")
             raise HTTPException(status_code=400, detail="User not found. Please sign up or log in.")
 
         swipes_dict = [swipe.dict() for swipe in request.swipes]
-        success = recommendation_service.save_initial_quiz_submission(request.user_id, swipes_dict, supabase)
+        success = recommendation_service.save_initial_quiz_submission(request.user_id, swipes_dict)
         if not success:
             logger.error(f"Failed to save quiz submission for user_id: {request.user_id}")
             raise HTTPException(status_code=500, detail="Failed to save quiz submission")
@@ -40,20 +50,15 @@ def submit_initial_quiz_route(request: InitialQuizSubmission):
         raise HTTPException(status_code=500, detail=f"Failed to save quiz submission: {str(e)}")
 
 @router.get("/quiz/initial/required")
+@profiled
 def check_initial_quiz_required(user_id: str):
     try:
         logger.info(f"Checking profile status for user_id: {user_id}")
-        user_response = supabase.table("users").select("id").eq("id", user_id).execute()
-        if not user_response.data:
+        if not identity_cache.user_exists(user_id):
             logger.error(f"User not found for user_id: {user_id}")
             raise HTTPException(status_code=400, detail="User not found. Please sign up or log in.")
 
-        profile_response = supabase.table("profiles").select("id").eq("id", user_id).execute()
-        if profile_response.data is None:
-            logger.error(f"Profile query returned None for user_id: {user_id}")
-            raise HTTPException(status_code=500, detail="Profile query failed")
-
-        required = not bool(profile_response.data)
+        required = not identity_cache.profile_exists(user_id)
         logger.info(f"Profile required for user_id: {user_id}: {required}")
         return {"required": required}
     except Exception as e:
@@ -61,6 +66,7 @@ def check_initial_quiz_required(user_id: str):
         raise HTTPException(status_code=500, detail=f"Failed to check profile: {str(e)}")
 
 @router.get("/quiz/refine", response_model=list[QuizImage])
+@profiled
 def get_refine_quiz_route():
     """
     Fetches 20 random images for the refinement quiz from the Supabase 'quiz_pool_img' table.
@@ -1,5 +1,6 @@
 from fastapi import APIRouter, HTTPException
 from services import recommendation_service
+from services.profiling import profiled
 from models.schemas import RefineTasteRequest, Recommendation, UserRequest
 import logging
 
@@ -9,6 +10,7 @@ logger = logging.getLogger(__name__)
 router = APIRouter()
 
 @router.post("/recommendations", response_model=list[Recommendation])
+@profiled
 def get_recommendations_route(request: UserRequest):
     """
     Generates personalized recommendations for a given user based on their
@@ -25,6 +27,7 @@ def get_recommendations_route(request: UserRequest):
 
 
 @router.post("/refine-taste")
+@profiled
 def refine_taste_route(request: RefineTasteRequest):
     """
     Refines a user's taste profile by merging new quiz swipes with their
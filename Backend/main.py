@@ -1,5 +1,8 @@
+import os
 from fastapi import FastAPI
-from api import quiz_routes, recommendation_routes # Import both routers
+from api import quiz_routes, recommendation_routes, admin_routes
+from services.profiling import ProfilingMiddleware
+from services.traffic_capture import TrafficCaptureMiddleware
 import uvicorn
 
 app = FastAPI(
@@ -13,6 +16,19 @@ app = FastAPI(
 # routes like /api/quiz/initial and /api/recommendations
 app.include_router(quiz_routes.router, prefix="/api", tags=["Quiz"])
 app.include_router(recommendation_routes.router, prefix="/api", tags=["Recommendations"])
+app.include_router(admin_routes.router, prefix="/api", tags=["Admin"])
+
+# On-demand (X-Profile-Token header or admin window) and slow-request profiling.
+app.add_middleware(ProfilingMiddleware)
+
+# Opt-in traffic capture for scripts/replay_traffic.py. Records a sample of
+# /api requests, with user ids pseudonymized, to a gzip JSON-lines log.
+if os.getenv("TRAFFIC_CAPTURE_PATH"):
+    app.add_middleware(
+        TrafficCaptureMiddleware,
+        path=os.getenv("TRAFFIC_CAPTURE_PATH"),
+        sample_rate=float(os.getenv("TRAFFIC_CAPTURE_SAMPLE_RATE", "0.1")),
+    )
 
 
 @app.get("/", tags=["Root"])
@@ -0,0 +1,15 @@
+-- Resized image variants written by scripts/data_pipeline.py and returned by
+-- the API as `variants`, e.g. {"webp_300": "https://.../variants/<id>_300.webp"}.
+--
+-- Apply in the Supabase SQL editor BEFORE deploying an API that selects
+-- image_variants: PostgREST rejects selects of unknown columns, so the quiz
+-- and recommendation endpoints fail until the column exists. Safe to re-run.
+-- refine_quiz_img is not read with variants yet, but the pipeline writes them.
+
+ALTER TABLE public.initial_quiz_img   ADD COLUMN IF NOT EXISTS image_variants jsonb NOT NULL DEFAULT '{}'::jsonb;
+ALTER TABLE public.refine_quiz_img    ADD COLUMN IF NOT EXISTS image_variants jsonb NOT NULL DEFAULT '{}'::jsonb;
+ALTER TABLE public.quiz_pool_img      ADD COLUMN IF NOT EXISTS image_variants jsonb NOT NULL DEFAULT '{}'::jsonb;
+ALTER TABLE public.embedding_pool_img ADD COLUMN IF NOT EXISTS image_variants jsonb NOT NULL DEFAULT '{}'::jsonb;
+
+-- Make PostgREST pick up the new column without waiting for its schema cache to refresh.
+NOTIFY pgrst, 'reload schema';
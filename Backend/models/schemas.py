@@ -28,6 +28,8 @@ class Recommendation(BaseModel):
     primary_color: Optional[str] = "unknown"
     brand: Optional[str] = "Unknown Brand"
     price: Optional[float] = 0.0
+    # Resized copies of `image`, keyed "<format>_<width>" (e.g. "webp_300").
+    variants: Dict[str, str] = Field(default_factory=dict)
 
     class Config:
         orm_mode = True
@@ -37,6 +39,8 @@ class QuizImage(BaseModel):
     name: str
     uri: str
     metadata: Dict[str, Any]
+    # Resized copies of `uri`, keyed "<format>_<width>" (e.g. "webp_300").
+    variants: Dict[str, str] = Field(default_factory=dict)
 
     class Config:
         orm_mode = True
@@ -0,0 +1,70 @@
+"""
+Benchmarks GET /api/quiz/initial: the original handler (Supabase fetch,
+Pydantic validation and JSON serialization on every call) against the
+precomputed payload, with and without gzip and conditional revalidation.
+
+Run from the Backend directory with Supabase credentials in .env:
+    python scripts/bench_quiz_initial.py --requests 200
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from api import quiz_routes
+from models.schemas import QuizImage
+from services import recommendation_service
+
+
+def build_app() -> FastAPI:
+    app = FastAPI()
+    app.include_router(quiz_routes.router, prefix="/api")
+
+    @app.get("/legacy/quiz/initial", response_model=list[QuizImage])
+    def legacy_initial_quiz():
+        return recommendation_service.get_initial_quiz_from_supabase()
+
+    return app
+
+
+def run(client: TestClient, path: str, n: int, headers: dict) -> tuple[float, float, int]:
+    wire_bytes = 0
+    status = None
+    start = time.perf_counter()
+    for _ in range(n):
+        response = client.get(path, headers=headers)
+        status = response.status_code
+        # Content-Length reflects the encoded body actually put on the wire.
+        wire_bytes += int(response.headers.get("content-length", 0))
+    elapsed = time.perf_counter() - start
+    return n / elapsed, wire_bytes / n, status
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    client = TestClient(build_app())
+    warm = client.get("/api/quiz/initial")
+    etag = warm.headers["etag"]
+
+    scenarios = [
+        ("legacy handler", "/legacy/quiz/initial", {"accept-encoding": "identity"}),
+        ("precomputed", "/api/quiz/initial", {"accept-encoding": "identity"}),
+        ("precomputed + gzip", "/api/quiz/initial", {"accept-encoding": "gzip"}),
+        ("revalidation (304)", "/api/quiz/initial", {"if-none-match": etag}),
+    ]
+    print(f"{'scenario':<22}{'req/s':>12}{'bytes/resp':>14}{'status':>8}")
+    for label, path, headers in scenarios:
+        rps, avg_bytes, status = run(client, path, args.requests, headers)
+        print(f"{label:<22}{rps:>12.1f}{avg_bytes:>14.0f}{status:>8}")
+
+
+if __name__ == "__main__":
+    main()
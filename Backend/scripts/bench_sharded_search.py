@@ -0,0 +1,114 @@
+"""
+Benchmarks sharded vector search from 1 to 8 shards.
+
+Builds a synthetic IndexFlatL2 catalog (or reuses the real embeddings with
+--from-store), writes it as N shards, and measures query throughput through
+each coordinator mode, with one caller and with several concurrent callers
+(as under API load). Scaling efficiency is QPS(N) / (N * QPS(1)) within a
+mode and caller count. Results are checked against the unsharded index.
+
+Run from the Backend directory:
+    python scripts/bench_sharded_search.py --vectors 200000 --modes inprocess pool nodes
+"""
+import argparse
+import os
+import secrets
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+# Benchmark nodes only listen on loopback; a throwaway key is inherited by them.
+os.environ.setdefault("SHARD_AUTHKEY", secrets.token_hex(16))
+
+import faiss
+import numpy as np
+
+from services.shard_search import ShardedIndex, write_shards
+
+EMBEDDING_DIM = 512
+
+
+def measure(index, queries: np.ndarray, k: int, batch: int, duration: float, callers: int = 1) -> float:
+    """Queries per second with `callers` threads searching concurrently, as concurrent API requests would."""
+    def caller(seed: int) -> int:
+        done, start = 0, time.perf_counter()
+        while time.perf_counter() - start < duration:
+            offset = ((done + seed) * batch) % (len(queries) - batch)
+            index.search(queries[offset:offset + batch], k)
+            done += 1
+        return done
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=callers) as pool:
+        done = sum(pool.map(caller, range(0, callers * 97, 97)))
+    return done * batch / (time.perf_counter() - start)
+
+
+def start_nodes(shard_dir: str, num_shards: int, base_port: int) -> list:
+    processes = []
+    for shard_id in range(num_shards):
+        processes.append(subprocess.Popen(
+            [sys.executable, "-m", "services.shard_search", "serve", "--shard", str(shard_id),
+             "--manifest", os.path.join(shard_dir, "shards.json"), "--port", str(base_port + shard_id)],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        ))
+    time.sleep(3)  # Give each node time to load its shard and bind.
+    return processes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, default=200_000)
+    parser.add_argument("--from-store", help="Path to an existing FAISS index to shard instead of random data")
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--modes", nargs="+", default=["inprocess", "pool", "nodes"])
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--batch", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--callers", type=int, nargs="+", default=[1, 8], help="Concurrent searching threads")
+    parser.add_argument("--base-port", type=int, default=7100)
+    args = parser.parse_args()
+    faiss.omp_set_num_threads(1)
+
+    rng = np.random.default_rng(0)
+    if args.from_store:
+        source = faiss.read_index(args.from_store)
+        embeddings = source.reconstruct_n(0, source.ntotal)
+    else:
+        embeddings = rng.standard_normal((args.vectors, EMBEDDING_DIM), dtype=np.float32)
+    queries = rng.standard_normal((1024, embeddings.shape[1]), dtype=np.float32)
+
+    reference = faiss.IndexFlatL2(embeddings.shape[1])
+    reference.add(embeddings)
+    _, expected_ids = reference.search(queries[:16], args.k)
+
+    print(f"{len(embeddings)} vectors x {embeddings.shape[1]} dims, k={args.k}, batch={args.batch}")
+    print(f"{'mode':<10}{'shards':>7}{'callers':>8}{'QPS':>12}{'speedup':>9}{'efficiency':>12}")
+    for mode in args.modes:
+        baseline = {}
+        for num_shards in args.shards:
+            with tempfile.TemporaryDirectory() as shard_dir:
+                manifest = write_shards(embeddings, num_shards, shard_dir)
+                nodes, processes = None, []
+                if mode == "nodes":
+                    processes = start_nodes(shard_dir, num_shards, args.base_port)
+                    nodes = [("127.0.0.1", args.base_port + i) for i in range(num_shards)]
+                index = ShardedIndex(mode, manifest=manifest, nodes=nodes)
+                try:
+                    _, ids = index.search(queries[:16], args.k)
+                    assert np.array_equal(ids, expected_ids), f"{mode}/{num_shards} results differ from the unsharded index"
+                    rates = {callers: measure(index, queries, args.k, args.batch, args.duration, callers) for callers in args.callers}
+                finally:
+                    index.close()
+                    for process in processes:
+                        process.terminate()
+                for callers, qps in rates.items():
+                    baseline.setdefault(callers, qps)
+                    speedup = qps / baseline[callers]
+                    print(f"{mode:<10}{num_shards:>7}{callers:>8}{qps:>12.1f}{speedup:>9.2f}{speedup / num_shards:>12.0%}")
+
+if __name__ == "__main__":
+    main()
@@ -10,6 +10,14 @@ import numpy as np
 import cv2
 import pickle
 import random
+import io
+import time
+import copy
+import argparse
+import multiprocessing
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from PIL import features
 
 # Add parent directory to path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -25,6 +33,8 @@ except ImportError as e:
     else:
         raise e
 from services.supabase_client import supabase
+from services.shard_search import write_shards
+from pipeline_runner import Stage, run_pipeline, print_timings, file_fingerprint, dir_fingerprint
 
 # --- CONFIGURATION ---
 DATA_CSV_PATH = r"D:\Programming\Thuli_Datasets\train.csv"
@@ -34,10 +44,16 @@ IMAGE_DIR = r"D:\Programming\Thuli_Datasets\train"
 OUTPUT_DIR = "services/embedding_store"
 INDEX_FILE = os.path.join(OUTPUT_DIR, "inventory.index")
 METADATA_FILE = os.path.join(OUTPUT_DIR, "inventory_metadata.pkl")
+# Number of shards written alongside the single index for sharded search modes.
+EMBEDDING_SHARDS = int(os.getenv("EMBEDDING_SHARDS", "4"))
 
 QUIZ_POOL_SIZE = 2000
 INITIAL_QUIZ_SIZE = 40
 REFINE_QUIZ_SIZE = 20
+EMBEDDING_POOL_END = 6001
+# Fixed shuffle seed so a re-run reproduces the same split (and cache keys).
+PIPELINE_SEED = int(os.getenv("PIPELINE_SEED", "0"))
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", "4"))
 
 INITIAL_QUIZ_BUCKET = "initial_quiz_images"
 REFINE_QUIZ_BUCKET = "quiz_images"
@@ -45,6 +61,24 @@ QUIZ_POOL_BUCKET = "quiz_pool_images"
 EMBEDDING_BUCKET = "embedding_bucket"
 EMBEDDING_TABLE = "embedding_pool_img"
 
+# Resized, re-encoded copies uploaded next to each original under variants/.
+# AVIF is only produced when the installed Pillow was built with it.
+VARIANT_WIDTHS = (300, 600, 1200)
+VARIANT_FORMATS = ("webp", "avif") if features.check("avif") else ("webp",)
+VARIANT_QUALITY = {"webp": 80, "avif": 60}
+VARIANT_CONTENT_TYPES = {"webp": "image/webp", "avif": "image/avif"}
+# CPU-bound work (variant encoding, colour detection) runs on one spawn-context
+# process pool shared by every stage, so the upload stages running side by
+# side share PIPELINE_PROCESSES cores instead of each starting their own pool.
+PIPELINE_PROCESSES = int(os.getenv("PIPELINE_PROCESSES", str(os.cpu_count() or 1)))
+# Cards each upload stage keeps encoding at once (twice this many in flight).
+VARIANT_WORKERS = int(os.getenv("VARIANT_WORKERS", str(PIPELINE_PROCESSES)))
+# Colour-detection tasks kept in flight by the attributes stage.
+COLOR_WORKERS = int(os.getenv("COLOR_WORKERS", str(PIPELINE_PROCESSES)))
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
 COLOR_MAP = {
     (255, 0, 0): "red",
     (0, 255, 0): "green",
@@ -98,7 +132,7 @@ def map_attributes_to_schema(categories: set, attributes: set) -> dict:
             schema["pattern"] = attr.split("-")[-1]
     return schema
 
-def load_and_preprocess_data():
+def load_and_preprocess_data(seed: int | None = None):
     df = pd.read_csv(DATA_CSV_PATH)
     with open(LABEL_JSON_PATH) as f:
         label_data = json.load(f)
@@ -121,10 +155,115 @@ def load_and_preprocess_data():
         data['structured_metadata'] = structured_attrs
         structured_metadata.append(data)
     
-    random.shuffle(structured_metadata)
+    random.Random(seed).shuffle(structured_metadata)
     return structured_metadata
 
-def upload_to_supabase(bucket_name: str, table_name: str, items: list):
+def generate_image_variants(local_path: str) -> dict:
+    """
+    Returns {"webp_300": bytes, ...} for every configured format and width.
+    Widths larger than the original are skipped (never upscale), but the
+    smallest width is always produced so every card has at least one variant.
+    Runs in worker processes, so it must stay a top-level function.
+    """
+    variants = {}
+    with Image.open(local_path) as img:
+        img = img.convert("RGB")
+        widths = [w for w in VARIANT_WIDTHS if w <= img.width] or [min(VARIANT_WIDTHS)]
+        for width in widths:
+            height = max(1, round(img.height * width / img.width))
+            resized = img.resize((width, height), Image.LANCZOS)
+            for fmt in VARIANT_FORMATS:
+                buffer = io.BytesIO()
+                options = {"method": 6} if fmt == "webp" else {}
+                resized.save(buffer, format=fmt.upper(), quality=VARIANT_QUALITY[fmt], **options)
+                variants[f"{fmt}_{width}"] = buffer.getvalue()
+    return variants
+
+def process_pool() -> ProcessPoolExecutor:
+    """The shared process pool, started on first use."""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(max_workers=PIPELINE_PROCESSES, mp_context=multiprocessing.get_context("spawn"))
+        return _process_pool
+
+def shutdown_process_pool() -> None:
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is not None:
+            _process_pool.shutdown()
+            _process_pool = None
+
+def imap_bounded(func, items: list, limit: int, arg=lambda item: item):
+    """
+    Runs func(arg(item)) for each item on the shared process pool, keeping at
+    most `limit` tasks in flight. Yields (item, future) in completion order.
+    """
+    remaining = iter(items)
+    pending = {}
+    pool = process_pool()
+    while True:
+        for item in remaining:
+            pending[pool.submit(func, arg(item))] = item
+            if len(pending) >= limit:
+                break
+        if not pending:
+            return
+        finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in finished:
+            yield pending.pop(future), future
+
+def iter_image_variants(items: list):
+    """
+    Encodes variants on the shared process pool and yields (item, variants)
+    as each card finishes, so the caller can upload and drop the bytes right
+    away. At most 2 * VARIANT_WORKERS cards are in flight, which bounds memory
+    by the worker settings rather than the catalog size. Items whose encoding
+    failed are yielded with no variants.
+    """
+    start = time.perf_counter()
+    encoded, source_bytes = 0, 0
+    for item, future in imap_bounded(generate_image_variants, items, VARIANT_WORKERS * 2, arg=lambda item: item['path']):
+        try:
+            variants = future.result()
+            encoded += 1
+            source_bytes += os.path.getsize(item['path'])
+        except Exception as e:
+            tqdm.write(f"Failed to encode variants for {item['id']}: {e}")
+            variants = {}
+        yield item, variants
+    elapsed = time.perf_counter() - start
+    print(f"Encoded variants for {encoded} images in {elapsed:.1f}s "
+          f"({encoded / max(elapsed, 1e-9):.1f} images/s, {source_bytes / max(elapsed, 1e-9) / 1e6:.1f} MB/s source)")
+
+def tally_variant_sizes(totals: dict, item: dict, variants: dict) -> None:
+    """Adds one card's original and variant sizes to `totals` for report_variant_savings."""
+    if not variants:
+        return
+    totals["cards"] = totals.get("cards", 0) + 1
+    totals["original"] = totals.get("original", 0) + os.path.getsize(item['path'])
+    for key, data in variants.items():
+        size = totals.setdefault("variants", {}).setdefault(key, [0, 0])
+        size[0] += len(data)
+        size[1] += 1
+
+def report_variant_savings(totals: dict) -> None:
+    """Prints how many bytes a card download saves per variant compared to the original JPEG."""
+    cards, original_total = totals.get("cards", 0), totals.get("original", 0)
+    if not original_total:
+        return
+    print(f"Original JPEG: {original_total / cards / 1024:.1f} KiB per card")
+    for key, (total, count) in sorted(totals["variants"].items()):
+        saved = original_total / cards - total / count
+        print(f"  {key:<10} {total / count / 1024:8.1f} KiB per card, saves {saved / 1024:8.1f} KiB ({saved / (original_total / cards):.0%})")
+
+def upload_to_supabase(bucket_name: str, table_name: str, items: list) -> list | None:
+    """
+    Uploads images and variants, upserts their rows and returns the upserted
+    names (None if the bucket is unusable). `items` are shared with stages
+    running in parallel and must not be modified; colours are filled in by
+    the attributes stage.
+    """
     print(f"\nUploading {len(items)} items to Supabase table '{table_name}' and bucket '{bucket_name}'...")
     
     try:
@@ -145,17 +284,22 @@ def upload_to_supabase(bucket_name: str, table_name: str, items: list):
         print(f"An error occurred during bucket setup: {e}")
         return
 
-    for item in tqdm(items, desc=f"Uploading to {bucket_name}"):
+    uploaded = []
+    sizes = {}
+    present = []
+    for item in items:
+        if os.path.exists(item['path']):
+            present.append(item)
+        else:
+            tqdm.write(f"Image not found: {item['path']}")
+
+    # Each card is uploaded as soon as its variants are encoded, and its bytes
+    # are dropped before the next one, instead of holding the whole catalog.
+    for item, variants in tqdm(iter_image_variants(present), total=len(present), desc=f"Uploading to {bucket_name}"):
         try:
             image_id = item['id']
             local_path = item['path']
-            if not os.path.exists(local_path):
-                tqdm.write(f"Image not found: {local_path}")
-                continue
-
-            if item['structured_metadata']['primary_color'] == "unknown":
-                item['structured_metadata']['primary_color'] = detect_dominant_color(local_path)
-                tqdm.write(f"Detected color for {image_id}: {item['structured_metadata']['primary_color']}")
+            tally_variant_sizes(sizes, item, variants)
 
             bucket_file_path = f"{image_id}.jpg"
             existing_files = supabase.storage.from_(bucket_name).list()
@@ -172,19 +316,35 @@ def upload_to_supabase(bucket_name: str, table_name: str, items: list):
                 tqdm.write(f"Uploaded {bucket_file_path} to bucket {bucket_name}.")
 
             public_url = supabase.storage.from_(bucket_name).get_public_url(bucket_file_path)
+
+            image_variants = {}
+            for key, data in variants.items():
+                fmt, width = key.split("_")
+                variant_path = f"variants/{image_id}_{width}.{fmt}"
+                supabase.storage.from_(bucket_name).upload(
+                    file=data,
+                    path=variant_path,
+                    file_options={"content-type": VARIANT_CONTENT_TYPES[fmt], "upsert": "true"}
+                )
+                image_variants[key] = supabase.storage.from_(bucket_name).get_public_url(variant_path)
+
             db_record = {
                 "name": item['id'],
                 "image_url": public_url,
+                "image_variants": image_variants,
                 "metadata": item['structured_metadata']
             }
             supabase.table(table_name).upsert(db_record, on_conflict="name").execute()
+            uploaded.append(image_id)
         except Exception as e:
             tqdm.write(f"Failed to upload {image_id}: {e}")
+    report_variant_savings(sizes)
+    return uploaded
 
-def build_embedding_store(items: list):
+def compute_embeddings(items: list) -> tuple:
+    """Embeds each item's image from the embedding bucket. Returns (embeddings, metadata) for the items that worked."""
     print(f"\nBuilding embedding store with {len(items)} items...")
     model = SentenceTransformer('clip-ViT-B-32')
-    embedding_dim = 512
     all_embeddings, all_metadata = [], []
 
     for item in tqdm(items, desc="Generating embeddings"):
@@ -204,38 +364,123 @@ def build_embedding_store(items: list):
         except Exception as e:
             tqdm.write(f"Skipping image {item['id']} due to error: {e}")
             continue
-    
-    if not all_embeddings:
-        print("No embeddings generated. Exiting.")
-        return
 
-    embeddings_np = np.array(all_embeddings).astype('float32')
+    return np.array(all_embeddings).astype('float32'), all_metadata
+
+def write_embedding_store(embeddings_np: np.ndarray, all_metadata: list, num_shards: int = EMBEDDING_SHARDS) -> list:
+    """Writes the FAISS index, optional shards and metadata. Returns the written paths."""
+    embedding_dim = 512
     index = faiss.IndexFlatL2(embedding_dim)
     index.add(embeddings_np)
-    
+
     os.makedirs(OUTPUT_DIR, exist_ok=True)
     faiss.write_index(index, INDEX_FILE)
     print(f"FAISS index saved to {INDEX_FILE}")
+    written = [INDEX_FILE, METADATA_FILE]
+    if num_shards > 1:
+        manifest = write_shards(embeddings_np, num_shards, OUTPUT_DIR)
+        print(f"Wrote {len(manifest['shards'])} shards: {[s['size'] for s in manifest['shards']]}")
+        written += [shard['index_file'] for shard in manifest['shards']]
     with open(METADATA_FILE, 'wb') as f:
         pickle.dump(all_metadata, f)
     print(f"Metadata saved to {METADATA_FILE}")
+    return written
 
-def main():
-    print("--- Starting Full Data Pipeline ---")
-    all_data = load_and_preprocess_data()
-    
-    quiz_pool = all_data[:QUIZ_POOL_SIZE]
-    embedding_pool = all_data[QUIZ_POOL_SIZE:6001]
-    print(f"Data split: {len(quiz_pool)} for quizzes, {len(embedding_pool)} for recommendations.")
+def build_embedding_store(items: list, num_shards: int = EMBEDDING_SHARDS):
+    embeddings_np, all_metadata = compute_embeddings(items)
+    if not len(embeddings_np):
+        print("No embeddings generated. Exiting.")
+        return
+    write_embedding_store(embeddings_np, all_metadata, num_shards)
+
+# --- PIPELINE STAGES ---
+# Each stage receives its dependencies' outputs as keyword arguments (named
+# after the upstream stage) plus its config. See scripts/pipeline_runner.py.
 
-    # upload_to_supabase(INITIAL_QUIZ_BUCKET, "initial_quiz_img", quiz_pool[:INITIAL_QUIZ_SIZE])
-    # upload_to_supabase(REFINE_QUIZ_BUCKET, "refine_quiz_img", quiz_pool[INITIAL_QUIZ_SIZE:INITIAL_QUIZ_SIZE + REFINE_QUIZ_SIZE])
-    # upload_to_supabase(QUIZ_POOL_BUCKET, "quiz_pool_img", quiz_pool)
-    # upload_to_supabase(EMBEDDING_BUCKET, EMBEDDING_TABLE, embedding_pool)
+def stage_load(seed: int) -> list:
+    return load_and_preprocess_data(seed)
 
-    build_embedding_store(embedding_pool)
+def stage_split(load: list, quiz_pool_size: int, embedding_pool_end: int) -> dict:
+    split = {"quiz_pool": load[:quiz_pool_size], "embedding_pool": load[quiz_pool_size:embedding_pool_end]}
+    print(f"Data split: {len(split['quiz_pool'])} for quizzes, {len(split['embedding_pool'])} for recommendations.")
+    return split
 
+def stage_attributes(split: dict) -> dict:
+    """Fills in primary_color by dominant-color detection where the annotations had none."""
+    split = copy.deepcopy(split)
+    missing = [item for pool in split.values() for item in pool
+               if item['structured_metadata']['primary_color'] == "unknown" and os.path.exists(item['path'])]
+    detections = imap_bounded(detect_dominant_color, missing, COLOR_WORKERS, arg=lambda item: item['path'])
+    for item, future in tqdm(detections, total=len(missing), desc="Detecting colors"):
+        item['structured_metadata']['primary_color'] = future.result()
+    return split
+
+def stage_upload(attributes: dict, pool: str, start: int, end: int | None, bucket: str, table: str) -> list:
+    uploaded = upload_to_supabase(bucket, table, attributes[pool][start:end])
+    if uploaded is None:
+        raise RuntimeError(f"Bucket '{bucket}' could not be prepared")
+    return uploaded
+
+def stage_embed(attributes: dict, upload_embedding: list | None) -> tuple:
+    # Only items that made it into the embedding bucket can be fetched back.
+    # A skipped upload stage means the bucket is assumed to be populated already.
+    items = copy.deepcopy(attributes["embedding_pool"])
+    if upload_embedding is not None:
+        uploaded = set(upload_embedding)
+        items = [item for item in items if item['id'] in uploaded]
+    embeddings_np, all_metadata = compute_embeddings(items)
+    if not len(embeddings_np):
+        raise RuntimeError("No embeddings generated")
+    return embeddings_np, all_metadata
+
+def stage_index(embed: tuple, num_shards: int) -> list:
+    return write_embedding_store(*embed, num_shards=num_shards)
+
+def build_stages() -> list:
+    # Scanned once; every image-reading stage shares the result.
+    image_fingerprint = dir_fingerprint(IMAGE_DIR)
+    images = lambda: image_fingerprint
+    images_and_variants = lambda: [image_fingerprint, VARIANT_WIDTHS, VARIANT_FORMATS, VARIANT_QUALITY]
+    uploads = [
+        ("upload_initial", "quiz_pool", 0, INITIAL_QUIZ_SIZE, INITIAL_QUIZ_BUCKET, "initial_quiz_img"),
+        ("upload_refine", "quiz_pool", INITIAL_QUIZ_SIZE, INITIAL_QUIZ_SIZE + REFINE_QUIZ_SIZE, REFINE_QUIZ_BUCKET, "refine_quiz_img"),
+        ("upload_pool", "quiz_pool", 0, None, QUIZ_POOL_BUCKET, "quiz_pool_img"),
+        ("upload_embedding", "embedding_pool", 0, None, EMBEDDING_BUCKET, EMBEDDING_TABLE),
+    ]
+    return [
+        Stage("load", stage_load, config={"seed": PIPELINE_SEED},
+              helpers=(load_and_preprocess_data, map_attributes_to_schema),
+              fingerprint=lambda: file_fingerprint(DATA_CSV_PATH, LABEL_JSON_PATH)),
+        Stage("split", stage_split, deps=("load",),
+              config={"quiz_pool_size": QUIZ_POOL_SIZE, "embedding_pool_end": EMBEDDING_POOL_END}),
+        Stage("attributes", stage_attributes, deps=("split",), helpers=(detect_dominant_color,), fingerprint=images),
+        *[Stage(name, stage_upload, deps=("attributes",), fingerprint=images_and_variants,
+                helpers=(upload_to_supabase, iter_image_variants, generate_image_variants),
+                config={"pool": pool, "start": start, "end": end, "bucket": bucket, "table": table})
+          for name, pool, start, end, bucket, table in uploads],
+        Stage("embed", stage_embed, deps=("attributes", "upload_embedding"), helpers=(compute_embeddings,)),
+        Stage("index", stage_index, deps=("embed",), config={"num_shards": EMBEDDING_SHARDS},
+              helpers=(write_embedding_store, write_shards),
+              validate=lambda paths: all(os.path.exists(path) for path in paths)),
+    ]
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the data pipeline; stages whose inputs are unchanged are served from cache.")
+    parser.add_argument("--force", nargs="*", default=[], help="Stages to re-run even if cached")
+    parser.add_argument("--skip", nargs="*", default=[], help="Stages to leave out (dependents receive None)")
+    parser.add_argument("--workers", type=int, default=PIPELINE_WORKERS, help="Stages run in parallel")
+    args = parser.parse_args()
+
+    print("--- Starting Full Data Pipeline ---")
+    try:
+        results = run_pipeline(build_stages(), max_workers=args.workers, force=args.force, skip=args.skip)
+    finally:
+        shutdown_process_pool()
+    print_timings(results)
+    if any(result.status == "failed" for result in results.values()):
+        print("--- Data Pipeline Finished With Failures ---")
+        sys.exit(1)
     print("--- Full Data Pipeline Finished Successfully ---")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,213 @@
+"""
+Minimal DAG runner with content-addressed stage caching, used by
+data_pipeline.py.
+
+A stage's cache key hashes its name, the source of its function and of the
+helpers it declares, an explicit code version, its config, any external
+input fingerprint and a canonical digest of its dependencies' outputs.
+If nothing in that set changed, the pickled output from the last run is
+reused instead of running the stage. Stages whose dependencies are done
+run in parallel on a thread pool.
+"""
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+CACHE_DIR = ".pipeline_cache"
+
+
+@dataclass
+class Stage:
+    name: str
+    func: Callable[..., Any]
+    # Upstream stage names; their outputs are passed to `func` as keyword arguments.
+    deps: Tuple[str, ...] = ()
+    # Parameters passed to `func` and hashed into the cache key.
+    config: Dict[str, Any] = field(default_factory=dict)
+    # Fingerprint of inputs that live outside the pipeline (files, directories).
+    fingerprint: Optional[Callable[[], Any]] = None
+    # Rejects a cached output, e.g. when the files it points at were deleted.
+    validate: Optional[Callable[[Any], bool]] = None
+    # Functions the stage calls whose source should invalidate its cache.
+    helpers: Tuple[Callable[..., Any], ...] = ()
+    # Bump when anything else the output depends on changes (e.g. a module constant).
+    version: str = "1"
+
+
+@dataclass
+class StageResult:
+    name: str
+    status: str  # "ran", "cached", "skipped" or "failed"
+    seconds: float
+    output: Any = None
+    digest: str = ""
+
+
+def file_fingerprint(*paths: str) -> Dict[str, str]:
+    """sha256 of each file's content; missing files are recorded as such."""
+    fingerprints = {}
+    for path in paths:
+        if not os.path.exists(path):
+            fingerprints[path] = "missing"
+            continue
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        fingerprints[path] = digest.hexdigest()
+    return fingerprints
+
+
+def dir_fingerprint(path: str) -> str:
+    """Cheap fingerprint of a directory: name, size and mtime of every file, without reading content."""
+    if not os.path.isdir(path):
+        return "missing"
+    digest = hashlib.sha256()
+    for entry in sorted(os.scandir(path), key=lambda e: e.name):
+        if entry.is_file():
+            stat = entry.stat()
+            digest.update(f"{entry.name}:{stat.st_size}:{stat.st_mtime_ns}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _code_digest(*funcs: Callable[..., Any]) -> str:
+    """sha256 over the source of each function, in order."""
+    digest = hashlib.sha256()
+    for func in funcs:
+        try:
+            source = inspect.getsource(func)
+        except (OSError, TypeError):
+            source = getattr(func, "__qualname__", repr(func))
+        digest.update(source.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _update_digest(digest, value: Any) -> None:
+    """Feeds `value` into `digest` in a form that is stable across processes (unlike pickle of sets)."""
+    if value is None or isinstance(value, (bool, int, float, str)):
+        digest.update(json.dumps(value).encode("utf-8"))
+    elif isinstance(value, bytes):
+        digest.update(b"b%d:" % len(value) + value)
+    elif isinstance(value, dict):
+        digest.update(b"{")
+        for key in sorted(value, key=_output_digest):
+            _update_digest(digest, key)
+            _update_digest(digest, value[key])
+        digest.update(b"}")
+    elif isinstance(value, (set, frozenset)):
+        digest.update(b"<" + "".join(sorted(_output_digest(item) for item in value)).encode("ascii") + b">")
+    elif isinstance(value, (list, tuple)):
+        digest.update(b"[")
+        for item in value:
+            _update_digest(digest, item)
+        digest.update(b"]")
+    elif isinstance(value, np.ndarray):
+        digest.update(f"array:{value.dtype.str}:{value.shape}:".encode("utf-8"))
+        digest.update(np.ascontiguousarray(value).tobytes())
+    else:
+        digest.update(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def _output_digest(output: Any) -> str:
+    digest = hashlib.sha256()
+    _update_digest(digest, output)
+    return digest.hexdigest()
+
+
+def _stage_key(stage: Stage, dep_digests: Dict[str, str]) -> str:
+    payload = {
+        "name": stage.name,
+        "code": _code_digest(stage.func, *stage.helpers),
+        "version": stage.version,
+        "config": stage.config,
+        "fingerprint": stage.fingerprint() if stage.fingerprint else None,
+        "deps": dep_digests,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:32]
+
+
+def _run_stage(stage: Stage, upstream: Dict[str, StageResult], force: bool, cache_dir: str) -> StageResult:
+    start = time.perf_counter()
+    key = _stage_key(stage, {dep: upstream[dep].digest for dep in stage.deps})
+    cache_path = os.path.join(cache_dir, f"{stage.name}-{key}.pkl")
+    if not force and os.path.exists(cache_path):
+        with open(cache_path, "rb") as f:
+            blob = f.read()
+        output = pickle.loads(blob)
+        if stage.validate is None or stage.validate(output):
+            return StageResult(stage.name, "cached", time.perf_counter() - start, output, _output_digest(output))
+
+    output = stage.func(**{dep: upstream[dep].output for dep in stage.deps}, **stage.config)
+    blob = pickle.dumps(output, protocol=pickle.HIGHEST_PROTOCOL)
+    os.makedirs(cache_dir, exist_ok=True)
+    for stale in os.listdir(cache_dir):
+        if stale.startswith(f"{stage.name}-") and stale.endswith(".pkl"):
+            os.remove(os.path.join(cache_dir, stale))
+    with open(cache_path, "wb") as f:
+        f.write(blob)
+    return StageResult(stage.name, "ran", time.perf_counter() - start, output, _output_digest(output))
+
+
+def run_pipeline(stages: Iterable[Stage], max_workers: int = 4, force: Iterable[str] = (), skip: Iterable[str] = (),
+                 cache_dir: str = CACHE_DIR) -> Dict[str, StageResult]:
+    """
+    Runs `stages` in dependency order. Stages in `force` ignore their cache;
+    stages in `skip` are not run and hand `None` to their dependents.
+    """
+    stages = {stage.name: stage for stage in stages}
+    for stage in stages.values():
+        missing = [dep for dep in stage.deps if dep not in stages]
+        if missing:
+            raise ValueError(f"Stage '{stage.name}' depends on unknown stages: {missing}")
+    force, skip = set(force), set(skip)
+    results: Dict[str, StageResult] = {}
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while len(results) < len(stages):
+            progressed = False
+            for name, stage in stages.items():
+                if name in results or name in running.values():
+                    continue
+                if any(results.get(dep) is None for dep in stage.deps):
+                    continue
+                if any(results[dep].status == "failed" for dep in stage.deps):
+                    results[name] = StageResult(name, "failed", 0.0)
+                    print(f"[{name}] not run: an upstream stage failed")
+                    progressed = True
+                    continue
+                if name in skip:
+                    results[name] = StageResult(name, "skipped", 0.0, digest="skipped")
+                    progressed = True
+                    continue
+                print(f"[{name}] starting")
+                running[pool.submit(_run_stage, stage, results, name in force, cache_dir)] = name
+            if not running:
+                if not progressed:
+                    raise ValueError("Pipeline has a dependency cycle")
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                    print(f"[{name}] {results[name].status} in {results[name].seconds:.1f}s")
+                except Exception as e:
+                    results[name] = StageResult(name, "failed", 0.0)
+                    print(f"[{name}] failed: {e}")
+    return results
+
+
+def print_timings(results: Dict[str, StageResult]) -> None:
+    print(f"\n{'stage':<22}{'status':<10}{'seconds':>10}")
+    for result in results.values():
+        print(f"{result.name:<22}{result.status:<10}{result.seconds:>10.1f}")
+    print(f"{'total (sum)':<32}{sum(r.seconds for r in results.values()):>10.1f}")
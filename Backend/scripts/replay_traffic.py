@@ -0,0 +1,202 @@
+"""
+Replays captured API traffic against a local instance and reports per-route
+throughput, latency percentiles and error rates.
+
+Capture (opt-in) on a running instance:
+    TRAFFIC_CAPTURE_PATH=captures/traffic.jsonl.gz \\
+    SUPABASE_RECORD_PATH=captures/supabase.jsonl.gz \\
+    uvicorn main:app --port 8000
+
+Replay against a fresh local instance with Supabase swapped for the recording:
+    python scripts/replay_traffic.py captures/traffic.jsonl.gz \\
+        --supabase-recording captures/supabase.jsonl.gz --speedup 10 --concurrency 16 \\
+        --output release.json --baseline baseline.json
+
+Run from the Backend directory. With --base-url the instance is not started;
+pass --profile-token (the instance's PROFILE_TOKEN) to still get the stand-in
+hit/miss report. Queries the recording cannot answer are served as empty
+results, which skews the numbers, so misses are reported as a warning
+(--strict turns them into a failure).
+"""
+import argparse
+import json
+import os
+import secrets
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import requests
+
+from services.traffic_capture import read_traces
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_instance(recording: str, replay_latency: bool, token: str) -> tuple[subprocess.Popen, str]:
+    port = free_port()
+    env = dict(os.environ, SUPABASE_STANDIN_PATH=recording, SUPABASE_STANDIN_LATENCY="1" if replay_latency else "0",
+               PROFILE_TOKEN=token)
+    env.pop("TRAFFIC_CAPTURE_PATH", None)
+    env.pop("SUPABASE_RECORD_PATH", None)
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        env=env,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 120  # The embedding model can take a while to load.
+    while time.monotonic() < deadline:
+        try:
+            requests.get(base_url + "/", timeout=1)
+            return process, base_url
+        except requests.ConnectionError:
+            if process.poll() is not None:
+                raise RuntimeError("Local instance exited during startup")
+            time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError("Local instance did not start in time")
+
+
+def standin_stats(base_url: str, token: str) -> dict | None:
+    """Hits, misses and writes of the instance's Supabase stand-in, or None if unavailable."""
+    try:
+        response = requests.get(base_url + "/api/admin/stats", headers={"x-profile-token": token}, timeout=10)
+        response.raise_for_status()
+    except requests.RequestException as e:
+        print(f"WARNING: could not read stand-in stats: {e}")
+        return None
+    return response.json().get("supabase_standin")
+
+
+def percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))] if ordered else 0.0
+
+
+def replay(traces: list, base_url: str, speedup: float, concurrency: int) -> tuple[dict, float]:
+    results = {}
+    lock = threading.Lock()
+    local = threading.local()
+
+    def send(trace: dict) -> None:
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        url = base_url + trace["p"] + (f"?{trace['q']}" if trace.get("q") else "")
+        start = time.perf_counter()
+        try:
+            response = session.request(trace["m"], url, json=trace.get("b"), timeout=30)
+            error = response.status_code >= 500
+        except requests.RequestException:
+            error = True
+        elapsed = (time.perf_counter() - start) * 1000
+        with lock:
+            route = results.setdefault(f"{trace['m']} {trace['p']}", {"latencies": [], "errors": 0})
+            route["latencies"].append(elapsed)
+            route["errors"] += int(error)
+
+    traces = sorted(traces, key=lambda trace: trace["t"])
+    origin = traces[0]["t"] if traces else 0.0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for trace in traces:
+            if speedup > 0:
+                # Keep the captured inter-arrival gaps, compressed by the speed-up.
+                delay = (trace["t"] - origin) / speedup - (time.perf_counter() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            pool.submit(send, trace)
+    return results, time.perf_counter() - started
+
+
+def summarize(results: dict, wall_time: float) -> dict:
+    summary = {}
+    for route, data in sorted(results.items()):
+        latencies = data["latencies"]
+        summary[route] = {
+            "requests": len(latencies),
+            "rps": round(len(latencies) / wall_time, 2),
+            "p50_ms": round(percentile(latencies, 0.50), 2),
+            "p95_ms": round(percentile(latencies, 0.95), 2),
+            "p99_ms": round(percentile(latencies, 0.99), 2),
+            "error_rate": round(data["errors"] / len(latencies), 4),
+        }
+    return summary
+
+
+def print_report(summary: dict, baseline: dict) -> None:
+    print(f"{'route':<34}{'reqs':>7}{'rps':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>9}{'p95 vs base':>13}")
+    for route, stats in summary.items():
+        delta = ""
+        if route in baseline and baseline[route]["p95_ms"]:
+            delta = f"{stats['p95_ms'] / baseline[route]['p95_ms'] - 1:+.1%}"
+        print(f"{route:<34}{stats['requests']:>7}{stats['rps']:>9.1f}{stats['p50_ms']:>9.1f}{stats['p95_ms']:>9.1f}"
+              f"{stats['p99_ms']:>9.1f}{stats['error_rate']:>9.1%}{delta:>13}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("trace", help="Traffic capture written by TrafficCaptureMiddleware")
+    parser.add_argument("--supabase-recording", help="Supabase recording for the stand-in client")
+    parser.add_argument("--replay-supabase-latency", action="store_true", help="Delay stand-in answers by their recorded latency")
+    parser.add_argument("--base-url", help="Target an already running instance instead of starting one")
+    parser.add_argument("--speedup", type=float, default=1.0, help="Time compression factor; 0 replays as fast as possible")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--output", help="Write the per-route summary as JSON")
+    parser.add_argument("--baseline", help="Earlier --output file to compare against")
+    parser.add_argument("--profile-token", help="PROFILE_TOKEN of the --base-url instance, to read its stand-in stats")
+    parser.add_argument("--strict", action="store_true", help="Exit non-zero when the stand-in had to answer unrecorded reads")
+    args = parser.parse_args()
+
+    traces = read_traces(args.trace)
+    process = None
+    base_url = args.base_url
+    token = args.profile_token
+    if base_url is None:
+        if not args.supabase_recording:
+            parser.error("--supabase-recording is required unless --base-url is given")
+        token = secrets.token_hex(16)
+        process, base_url = start_instance(args.supabase_recording, args.replay_supabase_latency, token)
+    standin = None
+    try:
+        results, wall_time = replay(traces, base_url, args.speedup, args.concurrency)
+        if token:
+            standin = standin_stats(base_url, token)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=10)
+
+    summary = summarize(results, wall_time)
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print(f"Replayed {len(traces)} requests in {wall_time:.1f}s ({len(traces) / wall_time:.1f} req/s overall)")
+    print_report(summary, baseline)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=2)
+
+    if standin is None:
+        print("Supabase stand-in: no stats (not a stand-in instance, or no --profile-token)")
+        return
+    print(f"Supabase stand-in: {standin['hits']} hits, {standin['misses']} misses, {standin['writes']} writes")
+    if standin["misses"]:
+        print(f"WARNING: {standin['misses']} reads were missing from the recording and answered with no rows; "
+              "latencies and error rates above are not representative. Record a longer capture.")
+        if args.strict:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
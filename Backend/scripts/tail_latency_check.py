@@ -0,0 +1,120 @@
+"""
+Tail-latency check for the Supabase data-access layer.
+
+Starts a local fake PostgREST server that injects random delays and 5xx
+errors, then issues the same idempotent select through:
+  1. the bare Supabase client,
+  2. the gateway with deadlines only,
+  3. the gateway with deadlines and hedged reads,
+and finally hard-fails the server to show the circuit breaker serving the
+cached response instead of waiting on timeouts.
+
+Run from the Backend directory (no Supabase credentials needed):
+    python scripts/tail_latency_check.py --calls 300
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+# Point the module-level client at the fake server before services import it.
+os.environ.setdefault("SUPABASE_URL", "http://127.0.0.1:1")
+os.environ.setdefault("SUPABASE_SERVICE_KEY", "fake.service.key")
+
+from services.data_access import CircuitBreaker, DataAccessError, SupabaseGateway
+from services.supabase_client import create_pooled_client
+
+ROWS = [{"id": i, "name": f"item_{i}", "image_url": f"https://example.com/{i}.jpg", "metadata": {"type": "shirt"}} for i in range(40)]
+
+
+class FaultConfig:
+    base_delay = 0.02
+    slow_probability = 0.05
+    slow_delay = 1.0
+    error_probability = 0.02
+    hard_down = False
+
+
+class FakePostgrestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if FaultConfig.hard_down:
+            time.sleep(FaultConfig.slow_delay)
+            return self._send(503, {"message": "service unavailable"})
+        delay = random.expovariate(1 / FaultConfig.base_delay)
+        if random.random() < FaultConfig.slow_probability:
+            delay += FaultConfig.slow_delay
+        time.sleep(delay)
+        if random.random() < FaultConfig.error_probability:
+            return self._send(503, {"message": "injected failure"})
+        self._send(200, ROWS)
+
+    def _send(self, status: int, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def measure(label: str, call, calls: int) -> None:
+    latencies, errors = [], 0
+    for _ in range(calls):
+        start = time.perf_counter()
+        try:
+            call()
+        except Exception:
+            errors += 1
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    pct = lambda p: latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+    print(f"{label:<26}{statistics.median(latencies) * 1000:>9.1f}{pct(0.95):>9.1f}{pct(0.99):>9.1f}"
+          f"{latencies[-1] * 1000:>9.1f}{errors / calls:>9.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=300)
+    parser.add_argument("--deadline", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakePostgrestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = create_pooled_client(f"http://127.0.0.1:{server.server_port}", "fake.service.key")
+    query = lambda c: c.table("initial_quiz_img").select("id, name, image_url, metadata")
+
+    print(f"{'path':<26}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}{'errors':>9}")
+    measure("bare client", lambda: query(client).execute(), args.calls)
+    plain = SupabaseGateway(client, read_deadline=args.deadline, hedge=False, breaker=CircuitBreaker(10_000))
+    measure("gateway, deadline only", lambda: plain.select(query), args.calls)
+    hedged = SupabaseGateway(client, read_deadline=args.deadline, hedge=True, breaker=CircuitBreaker(10_000))
+    measure("gateway, hedged", lambda: hedged.select(query), args.calls)
+    print(f"hedged stats: {hedged.stats}")
+
+    breaker = SupabaseGateway(client, read_deadline=args.deadline, breaker=CircuitBreaker(3, reset_timeout=60))
+    breaker.select(query, cache_key="initial_quiz_img")
+    FaultConfig.hard_down = True
+    measure("outage, breaker+fallback", lambda: breaker.select(query, cache_key="initial_quiz_img"), args.calls // 10)
+    try:
+        breaker.select(query)
+    except DataAccessError as e:
+        print(f"uncached read during outage: {type(e).__name__}")
+    print(f"breaker state: {breaker.breaker.state}, stats: {breaker.stats}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Optional
+
+from postgrest.exceptions import APIError
+from supabase import Client
+
+from .supabase_client import supabase
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Per-call deadline and hedging knobs for reads and writes against Supabase.
+READ_DEADLINE = float(os.getenv("SUPABASE_READ_DEADLINE", "5"))
+WRITE_DEADLINE = float(os.getenv("SUPABASE_WRITE_DEADLINE", "10"))
+HEDGE_ENABLED = os.getenv("SUPABASE_HEDGE_ENABLED", "1") == "1"
+HEDGE_MIN_DELAY = float(os.getenv("SUPABASE_HEDGE_MIN_DELAY", "0.05"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("SUPABASE_BREAKER_FAILURES", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("SUPABASE_BREAKER_RESET_SECONDS", "30"))
+FALLBACK_CACHE_SIZE = int(os.getenv("SUPABASE_FALLBACK_CACHE_SIZE", "1024"))
+GATEWAY_WORKERS = int(os.getenv("SUPABASE_GATEWAY_WORKERS", "32"))
+
+
+class DataAccessError(Exception):
+    """Raised when Supabase cannot serve a call and no cached fallback exists."""
+
+
+class DeadlineExceeded(DataAccessError):
+    pass
+
+
+class CircuitOpenError(DataAccessError):
+    pass
+
+
+class LatencyTracker:
+    """Rolling window of successful call latencies used to pick the hedge delay."""
+
+    def __init__(self, window: int = 512):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        with self._lock:
+            if len(self._samples) < 20:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+class CircuitBreaker:
+    """
+    Classic closed/open/half-open breaker. After `failure_threshold`
+    consecutive transport failures the circuit opens for `reset_timeout`
+    seconds; the first call after that is let through as a trial.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return "half_open"
+            return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logger.warning(f"Supabase circuit opened after {self._failures} consecutive failures")
+                self._opened_at = time.monotonic()
+
+
+class SupabaseGateway:
+    """
+    Single entry point for Supabase table access.
+
+    Every call runs under a deadline. Idempotent reads (`select`) are hedged:
+    if the first attempt has not answered after the observed p95 latency, a
+    duplicate is sent and whichever finishes first wins. Reads that pass a
+    `cache_key` remember their last good response and serve it when the
+    circuit is open or the deadline is missed.
+    """
+
+    def __init__(
+        self,
+        client: Client,
+        read_deadline: float = READ_DEADLINE,
+        write_deadline: float = WRITE_DEADLINE,
+        hedge: bool = HEDGE_ENABLED,
+        hedge_min_delay: float = HEDGE_MIN_DELAY,
+        breaker: Optional[CircuitBreaker] = None,
+        cache_size: int = FALLBACK_CACHE_SIZE,
+        max_workers: int = GATEWAY_WORKERS,
+    ):
+        self.client = client
+        self.read_deadline = read_deadline
+        self.write_deadline = write_deadline
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self.breaker = breaker or CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT)
+        self.latency = LatencyTracker()
+        self.cache_size = cache_size
+        self._cache: OrderedDict[str, Any] = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="supabase")
+        self.stats = {"calls": 0, "hedged": 0, "hedge_wins": 0, "timeouts": 0, "failures": 0, "fallbacks": 0, "rejected": 0}
+
+    def select(self, build: Callable[[Client], Any], cache_key: Optional[str] = None, deadline: Optional[float] = None):
+        """Runs an idempotent query built by `build(client)` and returns its response."""
+        deadline = self.read_deadline if deadline is None else deadline
+        try:
+            response = self._call(build, deadline, hedge=self.hedge)
+        except DataAccessError:
+            cached = self._cached(cache_key)
+            if cached is None:
+                raise
+            self.stats["fallbacks"] += 1
+            logger.warning(f"Serving cached response for '{cache_key}'")
+            return cached
+        if cache_key is not None:
+            self._remember(cache_key, response)
+        return response
+
+    def write(self, build: Callable[[Client], Any], deadline: Optional[float] = None):
+        """Runs a non-idempotent query under a deadline, without hedging or fallback."""
+        deadline = self.write_deadline if deadline is None else deadline
+        return self._call(build, deadline, hedge=False)
+
+    def forget(self, cache_key: str) -> None:
+        with self._cache_lock:
+            self._cache.pop(cache_key, None)
+
+    def _call(self, build: Callable[[Client], Any], deadline: float, hedge: bool):
+        self.stats["calls"] += 1
+        if not self.breaker.allow():
+            self.stats["rejected"] += 1
+            raise CircuitOpenError("Supabase circuit is open")
+
+        started = time.monotonic()
+        expires = started + deadline
+        pending: set[Future] = {self._executor.submit(self._execute, build)}
+        hedge_future: Optional[Future] = None
+        if hedge:
+            hedge_delay = max(self.hedge_min_delay, self.latency.percentile(0.95) or 0.0)
+            done, _ = wait(pending, timeout=min(hedge_delay, deadline))
+            # Also hedge straight away when the primary already failed transiently.
+            failed_fast = bool(done) and any(f.exception() is not None and _is_transient(f.exception()) for f in done)
+            if (not done or failed_fast) and time.monotonic() < expires:
+                self.stats["hedged"] += 1
+                hedge_future = self._executor.submit(self._execute, build)
+                pending.add(hedge_future)
+
+        last_error: Optional[BaseException] = None
+        while pending:
+            remaining = expires - time.monotonic()
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                error = future.exception()
+                if error is None:
+                    if future is hedge_future:
+                        self.stats["hedge_wins"] += 1
+                    self.latency.record(time.monotonic() - started)
+                    self.breaker.record_success()
+                    return future.result()
+                if not _is_transient(error):
+                    # PostgREST answered; the request itself is wrong (e.g. no
+                    # rows for .single()). Not a health problem, and retrying won't help.
+                    self.breaker.record_success()
+                    raise error
+                last_error = error
+
+        self.breaker.record_failure()
+        if pending:
+            self.stats["timeouts"] += 1
+            raise DeadlineExceeded(f"Supabase call exceeded {deadline:.2f}s deadline")
+        self.stats["failures"] += 1
+        raise DataAccessError(f"Supabase call failed: {str(last_error)}") from last_error
+
+    def _execute(self, build: Callable[[Client], Any]):
+        return build(self.client).execute()
+
+    def _cached(self, cache_key: Optional[str]):
+        if cache_key is None:
+            return None
+        with self._cache_lock:
+            return self._cache.get(cache_key)
+
+    def _remember(self, cache_key: str, response: Any) -> None:
+        with self._cache_lock:
+            self._cache[cache_key] = response
+            self._cache.move_to_end(cache_key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+
+def _is_transient(error: BaseException) -> bool:
+    """Transport failures and HTTP 5xx count against Supabase health; PostgREST query errors don't."""
+    if not isinstance(error, APIError):
+        return True
+    code = str(error.code)
+    return len(code) == 3 and code.startswith("5")
+
+
+db = SupabaseGateway(supabase)
@@ -0,0 +1,110 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from .data_access import db, SupabaseGateway
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Staleness bounds. A cached "exists" answer is trusted for POSITIVE_TTL
+# seconds and a cached "missing" answer for NEGATIVE_TTL seconds. The
+# negative TTL is short because a user who just signed up must not be
+# rejected for long. Writes made through this process update the cache
+# immediately; the TTLs bound staleness for changes made elsewhere, such as
+# other workers or the Supabase dashboard.
+POSITIVE_TTL = float(os.getenv("IDENTITY_CACHE_POSITIVE_TTL", "300"))
+NEGATIVE_TTL = float(os.getenv("IDENTITY_CACHE_NEGATIVE_TTL", "10"))
+MAX_ENTRIES = int(os.getenv("IDENTITY_CACHE_MAX_ENTRIES", "100000"))
+
+
+class ExistenceCache:
+    """Bounded LRU of id -> (exists, expires_at) with separate positive/negative TTLs."""
+
+    def __init__(self, name: str, positive_ttl: float = POSITIVE_TTL, negative_ttl: float = NEGATIVE_TTL,
+                 max_entries: int = MAX_ENTRIES):
+        self.name = name
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[bool, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"positive_hits": 0, "negative_hits": 0, "misses": 0, "expired": 0, "writes": 0, "evictions": 0}
+
+    def get(self, key: str) -> Optional[bool]:
+        """Returns the cached answer, or None when unknown or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.counters["misses"] += 1
+                return None
+            exists, expires_at = entry
+            if time.monotonic() >= expires_at:
+                del self._entries[key]
+                self.counters["expired"] += 1
+                self.counters["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.counters["positive_hits" if exists else "negative_hits"] += 1
+            return exists
+
+    def mark(self, key: str, exists: bool) -> None:
+        ttl = self.positive_ttl if exists else self.negative_ttl
+        with self._lock:
+            self._entries[key] = (exists, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            self.counters["writes"] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.counters["evictions"] += 1
+
+    def invalidate(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.counters["positive_hits"] + self.counters["negative_hits"] + self.counters["misses"]
+            hits = lookups - self.counters["misses"]
+            return {
+                **self.counters,
+                "entries": len(self._entries),
+                "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+                "positive_ttl": self.positive_ttl,
+                "negative_ttl": self.negative_ttl,
+            }
+
+
+users = ExistenceCache("users")
+profiles = ExistenceCache("profiles")
+
+
+def user_exists(user_id: str, db: SupabaseGateway = db) -> bool:
+    """Checks the 'users' table, answering from the cache when possible."""
+    cached = users.get(user_id)
+    if cached is not None:
+        return cached
+    response = db.select(lambda c: c.table("users").select("id").eq("id", user_id))
+    exists = bool(response.data)
+    users.mark(user_id, exists)
+    return exists
+
+
+def profile_exists(user_id: str, db: SupabaseGateway = db) -> bool:
+    """Checks the 'profiles' table, answering from the cache when possible."""
+    cached = profiles.get(user_id)
+    if cached is not None:
+        return cached
+    response = db.select(lambda c: c.table("profiles").select("id").eq("id", user_id))
+    if response.data is None:
+        raise Exception("Profile query failed")
+    exists = bool(response.data)
+    profiles.mark(user_id, exists)
+    return exists
+
+
+def stats() -> dict:
+    return {"users": users.stats(), "profiles": profiles.stats()}
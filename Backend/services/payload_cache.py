@@ -0,0 +1,173 @@
+import gzip
+import hashlib
+import json
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Any, Callable, Hashable, Optional
+
+from fastapi import Request, Response
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class PayloadSnapshot:
+    """Pre-serialized response bytes for one version of a static endpoint."""
+    version: Hashable
+    body: bytes
+    gzip_body: Optional[bytes]
+    etag: str
+    last_modified: float
+
+    @property
+    def gzip_etag(self) -> str:
+        """Strong validator for the gzip body; each content-coding needs its own (RFC 9110 8.8.3)."""
+        return self.etag[:-1] + '-gz"'
+
+    @property
+    def last_modified_header(self) -> str:
+        return formatdate(self.last_modified, usegmt=True)
+
+
+class PrecomputedPayload:
+    """
+    Serves a static catalog endpoint from precomputed JSON bytes.
+
+    `build` returns the JSON-serializable payload and is only called when
+    `version_probe` reports a different table version (or after `max_stale`
+    seconds as a safety net for in-place row edits the probe cannot see).
+    The probe itself is throttled to once every `probe_interval` seconds.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        build: Callable[[], Any],
+        version_probe: Callable[[], Hashable],
+        max_age: int = 300,
+        probe_interval: float = 30.0,
+        max_stale: float = 3600.0,
+        compress_min_size: int = 1024,
+    ):
+        self.name = name
+        self._build = build
+        self._version_probe = version_probe
+        self.max_age = max_age
+        self.probe_interval = probe_interval
+        self.max_stale = max_stale
+        self.compress_min_size = compress_min_size
+        self._snapshot: Optional[PayloadSnapshot] = None
+        self._built_at = 0.0
+        self._probed_at = 0.0
+        self._lock = threading.Lock()
+
+    def invalidate(self) -> None:
+        """Forces the next request to re-probe and rebuild."""
+        with self._lock:
+            self._snapshot = None
+            self._probed_at = 0.0
+
+    def get(self) -> PayloadSnapshot:
+        now = time.monotonic()
+        snapshot = self._snapshot
+        if snapshot is not None and now - self._probed_at < self.probe_interval:
+            return snapshot
+
+        with self._lock:
+            # Another thread may have refreshed while we waited on the lock.
+            if self._snapshot is not None and now - self._probed_at < self.probe_interval:
+                return self._snapshot
+            try:
+                version = self._version_probe()
+            except Exception as e:
+                if self._snapshot is None:
+                    raise
+                logger.warning(f"Version probe for '{self.name}' failed, serving cached payload: {str(e)}")
+                self._probed_at = now
+                return self._snapshot
+
+            expired = now - self._built_at >= self.max_stale
+            if self._snapshot is None or self._snapshot.version != version or expired:
+                self._snapshot = self._serialize(version, self._build(), self._snapshot)
+                self._built_at = now
+            self._probed_at = now
+            return self._snapshot
+
+    def _serialize(self, version: Hashable, payload: Any, previous: Optional[PayloadSnapshot]) -> PayloadSnapshot:
+        body = json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+        etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+        # Keep the original timestamp when a rebuild produced identical bytes,
+        # so If-Modified-Since revalidation keeps returning 304.
+        if previous is not None and previous.etag == etag:
+            last_modified = previous.last_modified
+        else:
+            last_modified = time.time()
+        gzip_body = None
+        if len(body) >= self.compress_min_size:
+            gzip_body = gzip.compress(body, compresslevel=9, mtime=0)
+        logger.info(f"Rebuilt payload '{self.name}' (version={version}, {len(body)} bytes, gzip={len(gzip_body) if gzip_body else 'off'})")
+        return PayloadSnapshot(version=version, body=body, gzip_body=gzip_body, etag=etag, last_modified=last_modified)
+
+    def respond(self, request: Request) -> Response:
+        """Builds a 200 (optionally gzip-encoded) or 304 response for `request`."""
+        snapshot = self.get()
+        use_gzip = snapshot.gzip_body is not None and _accepts_gzip(request.headers.get("accept-encoding", ""))
+        headers = {
+            "ETag": snapshot.gzip_etag if use_gzip else snapshot.etag,
+            "Last-Modified": snapshot.last_modified_header,
+            "Cache-Control": f"public, max-age={self.max_age}, stale-while-revalidate={self.max_age}",
+            "Vary": "Accept-Encoding",
+        }
+        if _not_modified(request, snapshot):
+            return Response(status_code=304, headers=headers)
+
+        if use_gzip:
+            headers["Content-Encoding"] = "gzip"
+            return Response(content=snapshot.gzip_body, media_type="application/json", headers=headers)
+        return Response(content=snapshot.body, media_type="application/json", headers=headers)
+
+
+def _accepts_gzip(accept_encoding: str) -> bool:
+    """True when Accept-Encoding gives gzip (directly or via *) a non-zero q-value."""
+    qvalues = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qvalues[coding] = q
+    if "gzip" in qvalues:
+        return qvalues["gzip"] > 0
+    if "x-gzip" in qvalues:
+        return qvalues["x-gzip"] > 0
+    return qvalues.get("*", 0.0) > 0
+
+
+def _not_modified(request: Request, snapshot: PayloadSnapshot) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # If-None-Match takes precedence over If-Modified-Since (RFC 9110 13.1.3).
+        candidates = [tag.strip() for tag in if_none_match.split(",")]
+        # Either coding's tag identifies the same content version.
+        current = {snapshot.etag, snapshot.gzip_etag}
+        return "*" in candidates or any(tag.removeprefix("W/") in current for tag in candidates)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(snapshot.last_modified) <= since
+    return False
@@ -0,0 +1,271 @@
+import cProfile
+import functools
+import hmac
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# On-demand profiling is disabled unless a token is configured.
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+# Always-on slow-request sampler: a cheaper sampling rate, and profiles are
+# only kept for requests slower than SLOW_REQUEST_MS (0 disables it).
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "1500"))
+SLOW_SAMPLE_INTERVAL = float(os.getenv("SLOW_SAMPLE_INTERVAL", "0.02"))
+PROFILE_DISK_BUDGET_MB = float(os.getenv("PROFILE_DISK_BUDGET_MB", "100"))
+
+PROFILE_TOKEN_HEADER = "x-profile-token"
+PROFILE_MODE_HEADER = "x-profile-mode"
+PROFILE_ID_HEADER = "x-profile-id"
+PROFILE_MODES = ("sampling", "cprofile")
+
+
+@dataclass
+class ProfileRequest:
+    """Marks the current request for profiling; `files` collects what was written."""
+    mode: str = "sampling"
+    files: List[str] = field(default_factory=list)
+
+
+_profile_request: ContextVar[Optional[ProfileRequest]] = ContextVar("profile_request", default=None)
+_active = threading.local()
+_window = {"until": 0.0, "mode": "sampling"}
+# Only one cProfile profiler can be active per process on Python 3.12+
+# (sys.monitoring); concurrent cprofile requests fall back to sampling.
+_cprofile_lock = threading.Lock()
+
+
+class SamplerHub:
+    """
+    One background thread that snapshots the stacks of every registered
+    thread each `interval` seconds. Sampling many in-flight requests costs a
+    single sys._current_frames() call per tick.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._stacks: dict[int, Counter] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def register(self, thread_id: int) -> None:
+        with self._lock:
+            self._stacks[thread_id] = Counter()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+                self._thread.start()
+
+    def unregister(self, thread_id: int) -> Counter:
+        with self._lock:
+            return self._stacks.pop(thread_id, Counter())
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._stacks:
+                    continue
+                frames = sys._current_frames()
+                for thread_id, counter in self._stacks.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        counter[_stack_of(frame)] += 1
+
+
+def _stack_of(frame) -> tuple:
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+        frame = frame.f_back
+    return tuple(reversed(stack))
+
+
+_on_demand_hub = SamplerHub(PROFILE_SAMPLE_INTERVAL)
+_slow_hub = SamplerHub(SLOW_SAMPLE_INTERVAL)
+
+
+def write_collapsed(stacks: Counter, path: str) -> None:
+    """Brendan Gregg's collapsed-stack format, readable by flamegraph.pl and speedscope."""
+    with open(path, "w") as f:
+        for stack, count in stacks.most_common():
+            f.write(";".join(f"{name} ({os.path.basename(file)}:{line})" for name, file, line in stack) + f" {count}\n")
+
+
+def write_speedscope(stacks: Counter, interval: float, name: str, path: str) -> None:
+    frame_index, frames, samples, weights = {}, [], [], []
+    for stack, count in stacks.items():
+        sample = []
+        for frame in stack:
+            if frame not in frame_index:
+                frame_index[frame] = len(frames)
+                frames.append({"name": frame[0], "file": frame[1], "line": frame[2]})
+            sample.append(frame_index[frame])
+        samples.append(sample)
+        weights.append(count * interval)
+    document = {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "shared": {"frames": frames},
+        "profiles": [{
+            "type": "sampled", "name": name, "unit": "seconds",
+            "startValue": 0, "endValue": sum(weights), "samples": samples, "weights": weights,
+        }],
+        "name": name,
+        "exporter": "thuli-profiling",
+    }
+    with open(path, "w") as f:
+        json.dump(document, f)
+
+
+def enforce_disk_budget(directory: str = PROFILE_DIR, budget_mb: float = PROFILE_DISK_BUDGET_MB) -> None:
+    """Deletes the oldest profile files until the directory fits in the budget."""
+    files = []
+    for root, _, names in os.walk(directory):
+        for file_name in names:
+            path = os.path.join(root, file_name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= budget_mb * 1024 * 1024:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except FileNotFoundError:
+            pass
+
+
+def _output_base(subdir: str, name: str) -> str:
+    directory = os.path.join(PROFILE_DIR, subdir)
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{name}-{uuid.uuid4().hex[:8]}")
+
+
+def _save_samples(stacks: Counter, interval: float, subdir: str, name: str) -> List[str]:
+    base = _output_base(subdir, name)
+    write_collapsed(stacks, base + ".collapsed.txt")
+    write_speedscope(stacks, interval, name, base + ".speedscope.json")
+    enforce_disk_budget()
+    return [base + ".collapsed.txt", base + ".speedscope.json"]
+
+
+def profiled(func: Callable) -> Callable:
+    """
+    Profiles a synchronous route or service call in the thread running it.
+
+    Explicitly requested profiles (token header or admin window) are always
+    written. Otherwise the slow-request sampler watches the call and keeps
+    its profile only when it exceeds SLOW_REQUEST_MS. Nested profiled calls
+    are covered by the outermost one.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if getattr(_active, "depth", 0):
+            return func(*args, **kwargs)
+        request = _profile_request.get()
+        if request is None and SLOW_REQUEST_MS <= 0:
+            return func(*args, **kwargs)
+
+        thread_id = threading.get_ident()
+        profiler = None
+        hub = None
+        start = time.monotonic()
+        try:
+            _active.depth = 1
+            if request is not None and request.mode == "cprofile" and _cprofile_lock.acquire(blocking=False):
+                try:
+                    profiler = cProfile.Profile()
+                    profiler.enable()
+                except ValueError:
+                    # Another profiler (e.g. a debugger's) already owns the hook.
+                    profiler = None
+                    _cprofile_lock.release()
+            if profiler is None:
+                hub = _on_demand_hub if request is not None else _slow_hub
+                hub.register(thread_id)
+            return func(*args, **kwargs)
+        finally:
+            elapsed_ms = (time.monotonic() - start) * 1000
+            _active.depth = 0
+            if profiler is not None:
+                profiler.disable()
+                _cprofile_lock.release()
+            stacks = hub.unregister(thread_id) if hub is not None else None
+            try:
+                if profiler is not None:
+                    path = _output_base("on-demand", func.__name__) + ".prof"
+                    profiler.dump_stats(path)
+                    enforce_disk_budget()
+                    request.files.append(path)
+                elif request is not None and stacks is not None:
+                    request.files.extend(_save_samples(stacks, _on_demand_hub.interval, "on-demand", func.__name__))
+                elif stacks and elapsed_ms >= SLOW_REQUEST_MS:
+                    files = _save_samples(stacks, _slow_hub.interval, "slow", func.__name__)
+                    logger.warning(f"Slow call {func.__name__} took {elapsed_ms:.0f}ms; profile saved to {files[0]}")
+            except OSError as e:
+                logger.error(f"Failed to write profile for {func.__name__}: {str(e)}")
+    return wrapper
+
+
+def enable_window(seconds: float, mode: str = "sampling") -> float:
+    """Profiles every request for the next `seconds`. Returns the window end (epoch seconds)."""
+    _window["until"] = time.monotonic() + seconds
+    _window["mode"] = mode
+    return time.time() + seconds
+
+
+def token_valid(token: Optional[str]) -> bool:
+    return bool(PROFILE_TOKEN) and token is not None and hmac.compare_digest(token, PROFILE_TOKEN)
+
+
+class ProfilingMiddleware:
+    """
+    Marks requests for profiling when they carry a valid X-Profile-Token
+    header (X-Profile-Mode picks "sampling" or "cprofile"), or while an
+    admin profiling window is open. Written files are listed in the
+    X-Profile-Id response header.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in scope.get("headers", [])}
+        request = None
+        if token_valid(headers.get(PROFILE_TOKEN_HEADER)):
+            mode = headers.get(PROFILE_MODE_HEADER, "sampling")
+            request = ProfileRequest(mode=mode if mode in PROFILE_MODES else "sampling")
+        elif time.monotonic() < _window["until"]:
+            request = ProfileRequest(mode=_window["mode"])
+        if request is None:
+            return await self.app(scope, receive, send)
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start" and request.files:
+                names = ",".join(os.path.basename(path) for path in request.files)
+                message["headers"] = list(message.get("headers", [])) + [(PROFILE_ID_HEADER.encode(), names.encode("latin-1"))]
+            await send(message)
+
+        token = _profile_request.set(request)
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            _profile_request.reset(token)
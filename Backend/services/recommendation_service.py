@@ -1,13 +1,17 @@
 from typing import List, Dict, Any
 from models.schemas import Swipe, Recommendation, QuizImage
-from .supabase_client import supabase
-from supabase import Client
+from .data_access import db, SupabaseGateway
+from . import identity_cache
+from .profiling import profiled
+from .shard_search import ShardedIndex, load_manifest, parse_nodes, SHARD_MANIFEST_FILE
 import faiss
 import numpy as np
 import pickle
 from sentence_transformers import SentenceTransformer
 import random
 import logging
+import os
+import threading
 import time
 
 logging.basicConfig(level=logging.INFO)
@@ -15,9 +19,24 @@ logger = logging.getLogger(__name__)
 # --- LOAD THE LOCAL EMBEDDING STORE ON STARTUP ---
 INDEX_FILE = "services/embedding_store/inventory.index"
 METADATA_FILE = "services/embedding_store/inventory_metadata.pkl"
+# "single" searches inventory.index directly; "inprocess", "pool" and "nodes"
+# scatter-gather over the shards written by the data pipeline.
+SEARCH_MODE = os.getenv("SEARCH_MODE", "single")
+SEARCH_NODES = os.getenv("SEARCH_NODES", "")
 index = None
 model = None
 metadata = []
+_engine_lock = threading.Lock()
+
+
+def load_index():
+    """Loads the FAISS index, or a sharded coordinator with the same search interface."""
+    if SEARCH_MODE == "single":
+        return faiss.read_index(INDEX_FILE)
+    if SEARCH_MODE == "nodes" and not os.path.exists(SHARD_MANIFEST_FILE):
+        # Remote nodes hold the shards; the manifest is optional here.
+        return ShardedIndex(SEARCH_MODE, nodes=parse_nodes(SEARCH_NODES))
+    return ShardedIndex(SEARCH_MODE, manifest=load_manifest(SHARD_MANIFEST_FILE), nodes=parse_nodes(SEARCH_NODES))
 
 
 def initialize_engine() -> None:
@@ -25,28 +44,38 @@ def initialize_engine() -> None:
     global index, model, metadata
     if index and model and metadata:
         return
-    max_retries = 3
-    for attempt in range(max_retries):
-        try:
-            index = faiss.read_index(INDEX_FILE)
-            with open(METADATA_FILE, 'rb') as f:
-                metadata = pickle.load(f)
-            model = SentenceTransformer('clip-ViT-B-32')
-            logger.info("Recommendation engine loaded successfully.")
+    with _engine_lock:
+        if index and model and metadata:
             return
-        except FileNotFoundError as e:
-            logger.warning(f"Attempt {attempt + 1}/{max_retries} failed: {str(e)}")
-            if attempt == max_retries - 1:
-                logger.error("Failed to load embedding store after max retries.")
+        max_retries = 3
+        for attempt in range(max_retries):
+            try:
+                if not index:
+                    index = load_index()
+                if not metadata:
+                    with open(METADATA_FILE, 'rb') as f:
+                        metadata = pickle.load(f)
+                if not model:
+                    model = SentenceTransformer('clip-ViT-B-32')
+                logger.info("Recommendation engine loaded successfully.")
+                return
+            except FileNotFoundError as e:
+                logger.warning(f"Attempt {attempt + 1}/{max_retries} failed: {str(e)}")
+                if attempt == max_retries - 1:
+                    logger.error("Failed to load embedding store after max retries.")
+                    raise
+                time.sleep(2)  # Wait before retrying
+            except Exception as e:
+                logger.error(f"Unexpected error loading engine: {str(e)}")
                 raise
-            time.sleep(2)  # Wait before retrying
-        except Exception as e:
-            logger.error(f"Unexpected error loading engine: {str(e)}")
-            raise
 
 print("Loading recommendation engine components...")
 try:
-    index = faiss.read_index(INDEX_FILE)
+    # Sharded modes start worker processes or dial nodes, which must not
+    # happen at import time: spawned children re-import the app's main
+    # module. initialize_engine() builds them on first use instead.
+    if SEARCH_MODE == "single":
+        index = load_index()
     with open(METADATA_FILE, 'rb') as f:
         metadata = pickle.load(f)
     model = SentenceTransformer('clip-ViT-B-32')
@@ -61,11 +90,20 @@ except FileNotFoundError:
 def get_initial_quiz_from_supabase() -> List[QuizImage]:
     """ Fetches all 40 images for the initial quiz from the Supabase table. """
     print("Fetching initial quiz from Supabase...")
-    response = supabase.table("initial_quiz_img").select("id, name, image_url, metadata").execute()
+    response = db.select(lambda c: c.table("initial_quiz_img").select("id, name, image_url, image_variants, metadata"), cache_key="initial_quiz_img")
     if not response.data:
         return []
     # Map the database response to our Pydantic schema
-    return [QuizImage(id=item['id'], name=item['name'], uri=item['image_url'], metadata=item['metadata']) for item in response.data]
+    return [QuizImage(id=item['id'], name=item['name'], uri=item['image_url'], metadata=item['metadata'], variants=item.get('image_variants') or {}) for item in response.data]
+
+def get_initial_quiz_version() -> tuple:
+    """
+    Cheap version probe for the 'initial_quiz_img' table: row count plus the
+    highest id. Changes whenever the pipeline inserts or deletes quiz rows.
+    """
+    response = db.select(lambda c: c.table("initial_quiz_img").select("id", count="exact").order("id", desc=True).limit(1))
+    max_id = response.data[0]['id'] if response.data else None
+    return (response.count, max_id)
 
 def get_random_refine_quiz_images() -> list[QuizImage]:
     """
@@ -74,7 +112,7 @@ def get_random_refine_quiz_images() -> list[QuizImage]:
     try:
         logger.info("Fetching refine quiz")
         # Use raw SQL to select 20 random records
-        response = supabase.table("quiz_pool_img").select("*", count=None).execute()
+        response = db.select(lambda c: c.table("quiz_pool_img").select("*", count=None), cache_key="quiz_pool_img")
         if not response.data:
             logger.warning("No quiz pool images found")
             return []
@@ -82,7 +120,7 @@ def get_random_refine_quiz_images() -> list[QuizImage]:
         # Shuffle and limit to 20
         import random
         shuffled_data = random.sample(response.data, min(20, len(response.data)))
-        images = [QuizImage(id=item['id'], name=item['name'], uri=item['image_url'], metadata=item['metadata']) for item in shuffled_data]
+        images = [QuizImage(id=item['id'], name=item['name'], uri=item['image_url'], metadata=item['metadata'], variants=item.get('image_variants') or {}) for item in shuffled_data]
         logger.info(f"Refine quiz images fetched: {len(images)}")
         return images
     except Exception as e:
@@ -97,19 +135,21 @@ def get_unseen_refinement_quiz(user_id: str) -> List[QuizImage]:
     print(f"Fetching unseen refinement quiz for user: {user_id}")
     
     # 1. Get the list of quiz IDs the user has already seen
-    profile_response = supabase.table("profiles").select("seen_quiz_ids").eq("id", user_id).single().execute()
+    profile_response = db.select(lambda c: c.table("profiles").select("seen_quiz_ids").eq("id", user_id).single())
     seen_ids = []
     if profile_response.data and profile_response.data.get("seen_quiz_ids"):
         # The IDs are stored as the 'name' of the image
         seen_ids = [str(id_val) for id_val in profile_response.data["seen_quiz_ids"]]
 
     # 2. Fetch quiz images, excluding the ones already seen
-    query = supabase.table("refine_quiz_img").select("id, name, image_url, metadata")
-    if seen_ids:
-        # Use the .not_() filter to exclude seen IDs
-        query = query.not_("name", "in", tuple(seen_ids))
-        
-    quiz_response = query.execute()
+    def build_query(client):
+        query = client.table("refine_quiz_img").select("id, name, image_url, metadata")
+        if seen_ids:
+            # Use the .not_() filter to exclude seen IDs
+            query = query.not_("name", "in", tuple(seen_ids))
+        return query
+
+    quiz_response = db.select(build_query)
 
     if not quiz_response.data:
         print(f"No unseen questions found for user {user_id}.")
@@ -121,7 +161,7 @@ def get_unseen_refinement_quiz(user_id: str) -> List[QuizImage]:
     
     return [QuizImage(**item) for item in available_questions[:20]]
 
-def save_initial_quiz_submission(user_id: str, swipes: List[Dict[str, Any]], supabase: Client = supabase) -> bool:
+def save_initial_quiz_submission(user_id: str, swipes: List[Dict[str, Any]], db: SupabaseGateway = db) -> bool:
     """
     Saves the initial quiz swipes to the profiles table.
     Updates style_preferences and seen_quiz_ids.
@@ -147,19 +187,12 @@ def save_initial_quiz_submission(user_id: str, swipes: List[Dict[str, Any]], sup
             'updated_at': 'now()'
         }
 
-        # Check if profile exists
-        existing_profile = supabase.table('profiles').select('id').eq('id', user_id).execute()
-        
-        if existing_profile.data:
-            # Update existing profile
-            update_response = supabase.table('profiles').update({
-                'style_preferences': style_preferences,
-                'seen_quiz_ids': seen_quiz_ids,
-                'updated_at': 'now()'
-            }).eq('id', user_id).execute()
-        else:
-            # Insert new profile
-            update_response = supabase.table('profiles').insert(profile_data).execute()
+        # Upsert rather than choosing update/insert from the (possibly stale)
+        # existence cache: a stale "exists" would update 0 rows and lose the
+        # quiz, a stale "missing" would hit a duplicate key.
+        update_response = db.write(lambda c: c.table('profiles').upsert(profile_data, on_conflict='id'))
+        db.forget(f"profiles:style_preferences:{user_id}")
+        identity_cache.profiles.mark(user_id, True)
 
         return not (hasattr(update_response, 'error') and update_response.error is not None)
     except Exception as e:
@@ -183,6 +216,7 @@ def get_surreal_value(field: str, default: str | float) -> str | float:
         return random.choice(SURREAL_PRICES) if default == 0.0 else default
     return default
 
+@profiled
 def generate_recommendations(user_id: str) -> List[Recommendation]:
     """Generates personalized recommendations based on user taste profile."""
     try:
@@ -192,15 +226,17 @@ def generate_recommendations(user_id: str) -> List[Recommendation]:
             raise Exception("Recommendation engine not loaded")
 
         # Fetch user profile
-        response = supabase.table("profiles").select("style_preferences").eq("id", user_id).single().execute()
+        response = db.select(lambda c: c.table("profiles").select("style_preferences").eq("id", user_id).single(),
+                             cache_key=f"profiles:style_preferences:{user_id}")
         user_profile = response.data
         if not user_profile or not user_profile.get("style_preferences"):
             logger.warning(f"No style preferences found for user {user_id}, using default recommendations")
-            results = supabase.table("embedding_pool_img").select("name, image_url, metadata").limit(10).execute().data
+            results = db.select(lambda c: c.table("embedding_pool_img").select("name, image_url, image_variants, metadata").limit(10), cache_key="embedding_pool_img:default").data
             return [Recommendation(
                 id=res['name'],
                 name=f"{get_surreal_value('primary_color', res['metadata'].get('primary_color', 'Item'))} {res['metadata'].get('type', '')}",
                 image=res['image_url'],
+                variants=res.get('image_variants') or {},
                 fit=get_surreal_value('fit', res['metadata'].get('fit', 'regular')),
                 primary_color=get_surreal_value('primary_color', res['metadata'].get('primary_color', 'unknown')),
                 brand=get_surreal_value('brand', res['metadata'].get('brand', 'Unknown Brand')),
@@ -215,11 +251,12 @@ def generate_recommendations(user_id: str) -> List[Recommendation]:
             liked_swipes = [s for s in style_preferences if s.get("swipe") == 1]
             if not liked_swipes:
                 logger.warning(f"No liked swipes found for user {user_id}, using default recommendations")
-                results = supabase.table("embedding_pool_img").select("name, image_url, metadata").limit(10).execute().data
+                results = db.select(lambda c: c.table("embedding_pool_img").select("name, image_url, image_variants, metadata").limit(10), cache_key="embedding_pool_img:default").data
                 return [Recommendation(
                     id=res['name'],
                     name=f"{get_surreal_value('primary_color', res['metadata'].get('primary_color', 'Item'))} {res['metadata'].get('type', '')}",
                     image=res['image_url'],
+                    variants=res.get('image_variants') or {},
                     fit=get_surreal_value('fit', res['metadata'].get('fit', 'regular')),
                     primary_color=get_surreal_value('primary_color', res['metadata'].get('primary_color', 'unknown')),
                     brand=get_surreal_value('brand', res['metadata'].get('brand', 'Unknown Brand')),
@@ -241,11 +278,12 @@ def generate_recommendations(user_id: str) -> List[Recommendation]:
                 liked_texts = [" ".join(attrs)]
             else:
                 logger.warning(f"No valid attributes found for user {user_id}, using default recommendations")
-                results = supabase.table("embedding_pool_img").select("name, image_url, metadata").limit(10).execute().data
+                results = db.select(lambda c: c.table("embedding_pool_img").select("name, image_url, image_variants, metadata").limit(10), cache_key="embedding_pool_img:default").data
                 return [Recommendation(
                     id=res['name'],
                     name=f"{get_surreal_value('primary_color', res['metadata'].get('primary_color', 'Item'))} {res['metadata'].get('type', '')}",
                     image=res['image_url'],
+                    variants=res.get('image_variants') or {},
                     fit=get_surreal_value('fit', res['metadata'].get('fit', 'regular')),
                     primary_color=get_surreal_value('primary_color', res['metadata'].get('primary_color', 'unknown')),
                     brand=get_surreal_value('brand', res['metadata'].get('brand', 'Unknown Brand')),
@@ -258,11 +296,12 @@ def generate_recommendations(user_id: str) -> List[Recommendation]:
         # Generate taste profile embedding
         if not liked_texts:
             logger.warning(f"No liked texts generated for user {user_id}, using default recommendations")
-            results = supabase.table("embedding_pool_img").select("name, image_url, metadata").limit(10).execute().data
+            results = db.select(lambda c: c.table("embedding_pool_img").select("name, image_url, image_variants, metadata").limit(10), cache_key="embedding_pool_img:default").data
             return [Recommendation(
                 id=res['name'],
                 name=f"{get_surreal_value('primary_color', res['metadata'].get('primary_color', 'Item'))} {res['metadata'].get('type', '')}",
                 image=res['image_url'],
+                variants=res.get('image_variants') or {},
                 fit=get_surreal_value('fit', res['metadata'].get('fit', 'regular')),
                 primary_color=get_surreal_value('primary_color', res['metadata'].get('primary_color', 'unknown')),
                 brand=get_surreal_value('brand', res['metadata'].get('brand', 'Unknown Brand')),
@@ -281,7 +320,8 @@ def generate_recommendations(user_id: str) -> List[Recommendation]:
                 logger.warning(f"Index {i} out of bounds for metadata (length: {len(metadata)})")
                 continue
             item_meta = metadata[i]
-            response = supabase.table("embedding_pool_img").select("name, image_url, metadata").eq("name", item_meta['id']).single().execute()
+            response = db.select(lambda c: c.table("embedding_pool_img").select("name, image_url, image_variants, metadata").eq("name", item_meta['id']).single(),
+                                 cache_key=f"embedding_pool_img:{item_meta['id']}")
             if not response.data:
                 logger.warning(f"No Supabase record found for item {item_meta['id']}")
                 continue
@@ -290,6 +330,7 @@ def generate_recommendations(user_id: str) -> List[Recommendation]:
                 id=res['name'],
                 name=f"{get_surreal_value('primary_color', res['metadata'].get('primary_color', 'Item'))} {res['metadata'].get('type', '')}",
                 image=res['image_url'],
+                variants=res.get('image_variants') or {},
                 fit=get_surreal_value('fit', res['metadata'].get('fit', 'regular')),
                 primary_color=get_surreal_value('primary_color', res['metadata'].get('primary_color', 'unknown')),
                 brand=get_surreal_value('brand', res['metadata'].get('brand', 'Unknown Brand')),
@@ -310,11 +351,16 @@ def refine_taste_profile(user_id: str, new_swipes: List[Swipe]) -> bool:
     logger.info(f"Refining taste profile and updating seen quiz history for user: {user_id}")
     
     # 1. Fetch the user's current profile
-    response = supabase.table("profiles").select("style_preferences, seen_quiz_ids").eq("id", user_id).single().execute()
+    if identity_cache.profiles.get(user_id) is False:
+        logger.warning(f"No profile found for user {user_id} (cached)")
+        return False
+    response = db.select(lambda c: c.table("profiles").select("style_preferences, seen_quiz_ids").eq("id", user_id).single())
     logger.debug(f"Supabase response: {response}")
     if not response.data:
         logger.warning(f"No profile found for user {user_id}")
+        identity_cache.profiles.mark(user_id, False)
         return False
+    identity_cache.profiles.mark(user_id, True)
     
     # Ensure response.data is a dictionary
     if not isinstance(response.data, dict):
@@ -341,10 +387,11 @@ def refine_taste_profile(user_id: str, new_swipes: List[Swipe]) -> bool:
     updated_seen_ids = list(existing_seen_ids.union(newly_seen_ids))
 
     # 4. Update the profile with both new preferences and new history
-    update_response = supabase.table("profiles").update({
+    update_response = db.write(lambda c: c.table("profiles").update({
         "style_preferences": final_swipes,
         "seen_quiz_ids": updated_seen_ids
-    }).eq("id", user_id).execute()
+    }).eq("id", user_id))
+    db.forget(f"profiles:style_preferences:{user_id}")
 
     if hasattr(update_response, 'error') and update_response.error is not None:
         logger.error(f"Update failed: {update_response.error}")
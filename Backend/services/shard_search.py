@@ -0,0 +1,342 @@
+import argparse
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from multiprocessing.connection import Client, Connection, Listener
+from typing import Callable, Dict, List, Optional, Tuple
+
+import faiss
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SHARD_MANIFEST_FILE = "services/embedding_store/shards.json"
+# Shared secret for the "nodes" mode. multiprocessing.connection unpickles
+# what it receives, so a node must never accept unauthenticated peers.
+SHARD_AUTHKEY = os.getenv("SHARD_AUTHKEY", "")
+# FAISS threads per shard. Keeping this at 1 lets shards, not OpenMP, own the cores.
+SHARD_OMP_THREADS = int(os.getenv("SHARD_OMP_THREADS", "1"))
+# Searches a shard process or node runs at once for concurrent callers.
+SHARD_SERVER_THREADS = int(os.getenv("SHARD_SERVER_THREADS", "4"))
+# Seconds a scatter-gather search waits for all shards before failing.
+SHARD_TIMEOUT = float(os.getenv("SHARD_TIMEOUT", "5"))
+
+
+def write_shards(embeddings: np.ndarray, num_shards: int, output_dir: str) -> dict:
+    """
+    Splits `embeddings` into `num_shards` contiguous IndexFlatL2 shards and
+    writes them with a manifest. Row i of the full matrix keeps global id i,
+    so metadata lookups are unchanged whichever shard answers.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    shards = []
+    for shard_id, rows in enumerate(np.array_split(np.arange(len(embeddings)), num_shards)):
+        index = faiss.IndexFlatL2(embeddings.shape[1])
+        index.add(embeddings[rows])
+        index_file = os.path.join(output_dir, f"inventory.shard{shard_id}.index")
+        faiss.write_index(index, index_file)
+        shards.append({"index_file": index_file, "offset": int(rows[0]) if len(rows) else 0, "size": int(len(rows))})
+    manifest = {"dimension": int(embeddings.shape[1]), "ntotal": int(len(embeddings)), "shards": shards}
+    with open(os.path.join(output_dir, "shards.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def require_authkey() -> bytes:
+    """Returns SHARD_AUTHKEY, refusing to serve or connect to nodes without one."""
+    if len(SHARD_AUTHKEY) < 16:
+        raise RuntimeError("SHARD_AUTHKEY must be set to a secret of at least 16 characters to use shard nodes")
+    return SHARD_AUTHKEY.encode("utf-8")
+
+
+def load_manifest(path: str = SHARD_MANIFEST_FILE) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def merge_topk(results: List[Tuple[np.ndarray, np.ndarray]], k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Merges per-shard (distances, ids) of shape (n, k) into the global top-k by L2 distance."""
+    distances = np.concatenate([d for d, _ in results], axis=1)
+    ids = np.concatenate([i for _, i in results], axis=1)
+    order = np.argsort(distances, axis=1, kind="stable")[:, :k]
+    return np.take_along_axis(distances, order, axis=1), np.take_along_axis(ids, order, axis=1)
+
+
+class LocalShard:
+    """One FAISS shard in the current process; returns global ids."""
+
+    def __init__(self, index_file: str, offset: int):
+        self.index = faiss.read_index(index_file)
+        self.offset = offset
+
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        distances, ids = self.index.search(queries, min(k, self.index.ntotal) or 1)
+        ids = np.where(ids >= 0, ids + self.offset, -1)
+        if ids.shape[1] < k:
+            pad = k - ids.shape[1]
+            distances = np.pad(distances, ((0, 0), (0, pad)), constant_values=np.inf)
+            ids = np.pad(ids, ((0, 0), (0, pad)), constant_values=-1)
+        return distances, ids
+
+
+class RemoteShard:
+    """
+    A shard served by another process over a multiprocessing Connection.
+
+    Searches are multiplexed: each request is tagged with an id, and a reader
+    thread per connection resolves the matching future, so many callers can
+    have queries in flight on one connection. `connect` opens (or re-opens)
+    the connection and returns it with the worker process it talks to, if
+    any. A connection that fails, or has a request outlive its deadline, is
+    dropped (failing everything still pending on it) and re-opened on the
+    next search, so a restarted node or a crashed pool worker does not break
+    the coordinator.
+    """
+
+    def __init__(self, name: str, connect: Callable[[], Tuple[Connection, Optional[multiprocessing.Process]]]):
+        self.name = name
+        self._connect = connect
+        self._lock = threading.Lock()
+        self._conn: Optional[Connection] = None
+        self._process: Optional[multiprocessing.Process] = None
+        self._pending: Dict[int, Future] = {}
+        with self._lock:
+            self._open()
+
+    def _open(self) -> None:
+        conn, self._process = self._connect()
+        self._conn = conn
+        threading.Thread(target=self._read, args=(conn,), name=f"shard-reader-{self.name}", daemon=True).start()
+
+    def submit(self, request_id: int, queries: np.ndarray, k: int) -> Future:
+        future: Future = Future()
+        with self._lock:
+            try:
+                if self._conn is None:
+                    logger.warning(f"Reconnecting shard {self.name}")
+                    self._open()
+                self._pending[request_id] = future
+                self._conn.send(("search", request_id, queries, k))
+            except (OSError, EOFError) as e:
+                self._pending.pop(request_id, None)
+                self._drop(self._conn, e)
+                future.set_exception(ConnectionError(f"Shard {self.name} unreachable: {e}"))
+        return future
+
+    def expire(self, request_id: int) -> None:
+        """Called when `request_id` missed its deadline: treat the connection as hung."""
+        with self._lock:
+            if request_id in self._pending:
+                logger.warning(f"Shard {self.name} timed out; dropping its connection")
+                self._drop(self._conn, TimeoutError("search deadline exceeded"))
+
+    def _read(self, conn: Connection) -> None:
+        while True:
+            try:
+                # Poll with a timeout so the thread notices when its connection was dropped.
+                if not conn.poll(0.2):
+                    if conn is not self._conn:
+                        break
+                    continue
+                request_id, status, payload = conn.recv()
+            except (OSError, EOFError) as e:
+                with self._lock:
+                    self._drop(conn, e)
+                break
+            with self._lock:
+                future = self._pending.pop(request_id, None) if conn is self._conn else None
+            if future is None:
+                # A reply for a request that already expired or was failed.
+                logger.warning(f"Dropping stale reply {request_id} from shard {self.name}")
+            elif status == "ok":
+                future.set_result(payload)
+            else:
+                future.set_exception(RuntimeError(f"Shard {self.name} search failed: {payload}"))
+        try:
+            conn.close()
+        except OSError:
+            pass
+
+    def _drop(self, conn: Optional[Connection], error: BaseException) -> None:
+        """Forgets `conn` if it is still the live connection. Caller holds the lock."""
+        if conn is None or conn is not self._conn:
+            return
+        pending, self._pending = self._pending, {}
+        if self._process is not None and self._process.is_alive():
+            self._process.terminate()
+        self._conn, self._process = None, None
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError(f"Shard {self.name} connection lost: {error}"))
+
+    def close(self) -> None:
+        with self._lock:
+            conn, process = self._conn, self._process
+            self._conn, self._process = None, None
+        if conn is not None:
+            try:
+                conn.send(("close", None, None, 0))
+            except (OSError, EOFError):
+                pass
+        if process is not None:
+            process.join(timeout=5)
+
+
+def _serve_connection(conn: Connection, shard: LocalShard, threads: int = SHARD_SERVER_THREADS) -> None:
+    """
+    Answers search requests on `conn` until the peer closes it. Requests are
+    searched on a small thread pool (FAISS releases the GIL), so queries from
+    concurrent callers overlap; replies carry the request id and may arrive
+    out of order.
+    """
+    send_lock = threading.Lock()
+
+    def answer(request_id, queries, k):
+        try:
+            reply = (request_id, "ok", shard.search(queries, k))
+        except Exception as e:
+            reply = (request_id, "error", str(e))
+        with send_lock:
+            try:
+                conn.send(reply)
+            except (EOFError, OSError):
+                pass
+
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix="shard-search") as executor:
+        while True:
+            try:
+                command, request_id, queries, k = conn.recv()
+            except (EOFError, OSError):
+                return
+            if command == "close":
+                return
+            executor.submit(answer, request_id, queries, k)
+
+
+def _shard_worker(conn: Connection, index_file: str, offset: int, omp_threads: int) -> None:
+    faiss.omp_set_num_threads(omp_threads)
+    _serve_connection(conn, LocalShard(index_file, offset))
+
+
+def _spawn_worker(ctx, spec: dict, omp_threads: int) -> Callable[[], Tuple[Connection, multiprocessing.Process]]:
+    def connect():
+        parent_conn, child_conn = ctx.Pipe()
+        process = ctx.Process(target=_shard_worker, args=(child_conn, spec["index_file"], spec["offset"], omp_threads), daemon=True)
+        process.start()
+        child_conn.close()
+        return parent_conn, process
+    return connect
+
+
+def _dial_node(address: Tuple[str, int]) -> Callable[[], Tuple[Connection, None]]:
+    def connect():
+        return Client(address, authkey=require_authkey()), None
+    return connect
+
+
+class ShardedIndex:
+    """
+    Scatter-gather search coordinator over a set of shards.
+
+    Exposes the subset of the FAISS index interface the recommendation
+    service uses (`search` and `ntotal`), so it can stand in for a single
+    in-process index. Modes:
+      - "inprocess": shards live in this process, searched on a thread pool
+        (FAISS releases the GIL while searching);
+      - "pool": one spawned worker process per shard, reached over a Pipe;
+      - "nodes": shards served by `python -m services.shard_search serve`
+        on local or remote hosts, reached over TCP.
+    """
+
+    def __init__(self, mode: str, manifest: Optional[dict] = None, nodes: Optional[List[Tuple[str, int]]] = None,
+                 omp_threads: int = SHARD_OMP_THREADS, timeout: float = SHARD_TIMEOUT):
+        self.mode = mode
+        self.timeout = timeout
+        self._request_ids = itertools.count(1)
+        self._local: List[LocalShard] = []
+        self._remote: List[RemoteShard] = []
+        if mode == "inprocess":
+            self._local = [LocalShard(s["index_file"], s["offset"]) for s in manifest["shards"]]
+            self._executor = ThreadPoolExecutor(max_workers=len(self._local), thread_name_prefix="shard")
+            self.ntotal = sum(shard.index.ntotal for shard in self._local)
+        elif mode == "pool":
+            ctx = multiprocessing.get_context("spawn")
+            self._remote = [RemoteShard(s["index_file"], _spawn_worker(ctx, s, omp_threads)) for s in manifest["shards"]]
+            self.ntotal = manifest["ntotal"]
+        elif mode == "nodes":
+            self._remote = [RemoteShard(f"{host}:{port}", _dial_node((host, port))) for host, port in nodes]
+            self.ntotal = manifest["ntotal"] if manifest else None
+        else:
+            raise ValueError(f"Unknown search mode: {mode}")
+        logger.info(f"Sharded index ready: mode={mode}, shards={len(self._local) or len(self._remote)}")
+
+    @property
+    def num_shards(self) -> int:
+        return len(self._local) or len(self._remote)
+
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        queries = np.ascontiguousarray(queries, dtype="float32")
+        if self._local:
+            results = list(self._executor.map(lambda shard: shard.search(queries, k), self._local))
+            return merge_topk(results, k)
+        request_id = next(self._request_ids)
+        futures = [(shard, shard.submit(request_id, queries, k)) for shard in self._remote]
+        # Wait for every shard before raising, under one deadline for the
+        # whole search; a shard that misses it has its connection dropped.
+        deadline = time.monotonic() + self.timeout
+        results, errors = [], []
+        for shard, future in futures:
+            try:
+                results.append(future.result(timeout=max(0.0, deadline - time.monotonic())))
+            except FutureTimeoutError:
+                shard.expire(request_id)
+                errors.append(TimeoutError(f"Shard {shard.name} did not answer within {self.timeout}s"))
+            except Exception as e:
+                errors.append(e)
+        if errors:
+            raise errors[0]
+        return merge_topk(results, k)
+
+    def close(self) -> None:
+        for shard in self._remote:
+            shard.close()
+        if self._local:
+            self._executor.shutdown(wait=False)
+
+
+def parse_nodes(value: str) -> List[Tuple[str, int]]:
+    """Parses "host:port,host:port" into Listener addresses."""
+    nodes = []
+    for entry in filter(None, (part.strip() for part in value.split(","))):
+        host, port = entry.rsplit(":", 1)
+        nodes.append((host, int(port)))
+    return nodes
+
+
+def serve_node(shard: LocalShard, host: str, port: int) -> None:
+    """Serves one shard on a TCP Listener; each coordinator gets its own thread."""
+    with Listener((host, port), authkey=require_authkey()) as listener:
+        logger.info(f"Shard node listening on {host}:{port}")
+        while True:
+            conn = listener.accept()
+            threading.Thread(target=_serve_connection, args=(conn, shard), daemon=True).start()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve one embedding shard for the 'nodes' search mode.")
+    parser.add_argument("command", choices=["serve"])
+    parser.add_argument("--shard", type=int, required=True)
+    parser.add_argument("--manifest", default=SHARD_MANIFEST_FILE)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, required=True)
+    args = parser.parse_args()
+    faiss.omp_set_num_threads(SHARD_OMP_THREADS)
+    spec = load_manifest(args.manifest)["shards"][args.shard]
+    serve_node(LocalShard(spec["index_file"], spec["offset"]), args.host, args.port)
@@ -1,6 +1,8 @@
 import os
+import httpx
 from dotenv import load_dotenv
-from supabase import create_client, Client
+from supabase import create_client, Client, ClientOptions
+from .supabase_recording import RecordedSupabase, RecordingClient
 
 # Load environment variables from .env file
 load_dotenv()
@@ -8,5 +10,42 @@ load_dotenv()
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
 
+# HTTP tuning for PostgREST/Storage calls. The shared httpx client keeps
+# connections alive between requests instead of re-handshaking every call.
+SUPABASE_CONNECT_TIMEOUT = float(os.getenv("SUPABASE_CONNECT_TIMEOUT", "3"))
+SUPABASE_READ_TIMEOUT = float(os.getenv("SUPABASE_READ_TIMEOUT", "10"))
+SUPABASE_MAX_CONNECTIONS = int(os.getenv("SUPABASE_MAX_CONNECTIONS", "32"))
+SUPABASE_KEEPALIVE_CONNECTIONS = int(os.getenv("SUPABASE_KEEPALIVE_CONNECTIONS", "16"))
+SUPABASE_KEEPALIVE_EXPIRY = float(os.getenv("SUPABASE_KEEPALIVE_EXPIRY", "60"))
+
+
+def create_pooled_client(url: str, key: str) -> Client:
+    """Creates a Supabase client backed by a pooled, keep-alive httpx client."""
+    http_client = httpx.Client(
+        timeout=httpx.Timeout(SUPABASE_READ_TIMEOUT, connect=SUPABASE_CONNECT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=SUPABASE_MAX_CONNECTIONS,
+            max_keepalive_connections=SUPABASE_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=SUPABASE_KEEPALIVE_EXPIRY,
+        ),
+    )
+    options = ClientOptions(
+        postgrest_client_timeout=SUPABASE_READ_TIMEOUT,
+        storage_client_timeout=int(SUPABASE_READ_TIMEOUT),
+        httpx_client=http_client,
+    )
+    return create_client(url, key, options=options)
+
+
+# Traffic replay (scripts/replay_traffic.py) swaps the client for recorded
+# responses; SUPABASE_RECORD_PATH records them during a capture run.
+SUPABASE_STANDIN_PATH = os.getenv("SUPABASE_STANDIN_PATH")
+SUPABASE_RECORD_PATH = os.getenv("SUPABASE_RECORD_PATH")
+
 # Initialize the Supabase client
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
\ No newline at end of file
+if SUPABASE_STANDIN_PATH:
+    supabase: Client = RecordedSupabase(SUPABASE_STANDIN_PATH, replay_latency=os.getenv("SUPABASE_STANDIN_LATENCY", "0") == "1")
+else:
+    supabase: Client = create_pooled_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+    if SUPABASE_RECORD_PATH:
+        supabase = RecordingClient(supabase, SUPABASE_RECORD_PATH)
@@ -0,0 +1,171 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from postgrest.exceptions import APIError
+
+from .traffic_capture import TraceWriter, anonymize_id, read_traces, scrub_known_ids
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Methods that change data; the stand-in acknowledges them without a recording.
+WRITE_METHODS = {"insert", "update", "upsert", "delete"}
+# Tables whose "id" column is a user id. Those values are always pseudonymized,
+# whether or not the capture middleware has seen them.
+USER_ID_TABLES = {"users", "profiles"}
+FILTER_METHODS = {"eq", "neq", "in_"}
+
+
+@dataclass
+class RecordedResponse:
+    """Minimal stand-in for postgrest's APIResponse."""
+    data: Any
+    count: Optional[int] = None
+
+
+def _pseudonymize(value: Any) -> Any:
+    if isinstance(value, (list, tuple)):
+        return [_pseudonymize(v) for v in value]
+    # Ids coming from replayed traffic are already pseudonyms.
+    if value is None or str(value).startswith("anon-"):
+        return value
+    return anonymize_id(value)
+
+
+def _pseudonymize_ids(value: Any) -> Any:
+    """Pseudonymizes every "id" field in rows and write payloads, recursively."""
+    if isinstance(value, dict):
+        return {k: _pseudonymize(v) if k == "id" else _pseudonymize_ids(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_pseudonymize_ids(v) for v in value]
+    return value
+
+
+def _table_of(chain: list) -> Optional[str]:
+    return chain[0][1] if chain and chain[0][0] == "table" else None
+
+
+def _scrub_chain(chain: list) -> list:
+    """The call chain with user ids replaced by pseudonyms."""
+    if _table_of(chain) not in USER_ID_TABLES:
+        return scrub_known_ids(chain)
+    scrubbed, method = [], None
+    for step in chain:
+        if step[0] == "()":
+            args = list(step[1])
+            if method in FILTER_METHODS and len(args) >= 2 and args[0] == "id":
+                args[1] = _pseudonymize(args[1])
+            step = ["()", _pseudonymize_ids(args), _pseudonymize_ids(step[2])]
+        else:
+            method = step[0]
+        scrubbed.append(step)
+    return scrub_known_ids(scrubbed)
+
+
+def _scrub_data(chain: list, data: Any) -> Any:
+    if _table_of(chain) in USER_ID_TABLES:
+        data = _pseudonymize_ids(data)
+    return scrub_known_ids(data)
+
+
+def _query_key(chain: list) -> str:
+    """Stable key for a query, built from its (pseudonymized) builder call chain."""
+    normalized = json.dumps(_scrub_chain(chain), sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+
+class _Query:
+    """
+    Records builder calls such as table(...).select(...).eq(...) as a chain.
+    With a `target` the calls are forwarded to the real client and
+    execute() records the response. Without one, execute() answers from
+    the recording.
+    """
+
+    def __init__(self, owner, target, chain: list):
+        self._owner = owner
+        self._target = target
+        self._chain = chain
+
+    def __getattr__(self, name: str):
+        target = getattr(self._target, name) if self._target is not None else None
+        return _Query(self._owner, target, self._chain + [[name]])
+
+    def __call__(self, *args, **kwargs):
+        target = self._target(*args, **kwargs) if self._target is not None else None
+        return _Query(self._owner, target, self._chain + [["()", list(args), kwargs]])
+
+    def execute(self):
+        return self._owner.execute(self._target, self._chain)
+
+
+class RecordingClient:
+    """
+    Wraps a real Supabase client and records every table query's response.
+    Every query is recorded, not only those of captured requests, because the
+    process caches (identity checks, precomputed payloads) are usually filled
+    by an unsampled request, and replay needs those answers too. User ids in
+    users/profiles are always pseudonymized; other tables carry none.
+    """
+
+    def __init__(self, client, path: str):
+        self._client = client
+        self._writer = TraceWriter(path)
+
+    def table(self, name: str) -> _Query:
+        return _Query(self, self._client.table(name), [["table", name]])
+
+    def execute(self, target, chain: list):
+        start = time.monotonic()
+        record = {"k": _query_key(chain), "c": _scrub_chain(chain)}
+        try:
+            response = target.execute()
+        except APIError as e:
+            record.update(error=_scrub_data(chain, e.json()), ms=round((time.monotonic() - start) * 1000, 2))
+            self._writer.write(record)
+            raise
+        record.update(data=_scrub_data(chain, response.data), count=response.count,
+                      ms=round((time.monotonic() - start) * 1000, 2))
+        self._writer.write(record)
+        return response
+
+    def __getattr__(self, name: str):
+        # Storage, auth, etc. are passed straight through unrecorded.
+        return getattr(self._client, name)
+
+
+class RecordedSupabase:
+    """
+    Replays recorded Supabase responses in place of a live client.
+    Unrecorded reads return no rows; writes are acknowledged.
+    With `replay_latency` each answer is delayed by its recorded duration.
+    """
+
+    def __init__(self, path: str, replay_latency: bool = False):
+        self.replay_latency = replay_latency
+        self._responses = {record["k"]: record for record in read_traces(path)}
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "writes": 0}
+        logger.info(f"Loaded {len(self._responses)} recorded Supabase responses from {path}")
+
+    def table(self, name: str) -> _Query:
+        return _Query(self, None, [["table", name]])
+
+    def execute(self, target, chain: list):
+        record = self._responses.get(_query_key(chain))
+        is_write = any(step[0] in WRITE_METHODS for step in chain)
+        with self._lock:
+            self.stats["hits" if record else "writes" if is_write else "misses"] += 1
+        if record is None:
+            return RecordedResponse(data=[])
+        if self.replay_latency:
+            time.sleep(record.get("ms", 0) / 1000)
+        if "error" in record:
+            raise APIError(record["error"])
+        return RecordedResponse(data=record.get("data"), count=record.get("count"))
+
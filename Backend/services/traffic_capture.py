@@ -0,0 +1,158 @@
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from collections import OrderedDict
+from typing import Any
+from urllib.parse import parse_qsl, urlencode
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CAPTURE_SALT = os.getenv("TRAFFIC_CAPTURE_SALT", "thuli-capture").encode("utf-8")
+# Fields holding user identifiers, in JSON bodies and in query strings.
+ANONYMIZED_FIELDS = {"user_id"}
+
+_known_ids: OrderedDict[str, str] = OrderedDict()
+_known_ids_lock = threading.Lock()
+
+
+def anonymize_id(value: str) -> str:
+    """Stable, salted pseudonym for a user id. The same input always maps to the same output."""
+    digest = hmac.new(CAPTURE_SALT, str(value).encode("utf-8"), hashlib.sha256).hexdigest()[:24]
+    anonymized = f"anon-{digest}"
+    with _known_ids_lock:
+        _known_ids[str(value)] = anonymized
+        _known_ids.move_to_end(str(value))
+        while len(_known_ids) > 10000:
+            _known_ids.popitem(last=False)
+    return anonymized
+
+
+def scrub_known_ids(value: Any) -> Any:
+    """Replaces every raw id seen by `anonymize_id` with its pseudonym, recursively."""
+    if isinstance(value, str):
+        with _known_ids_lock:
+            return _known_ids.get(value, value)
+    if isinstance(value, dict):
+        return {k: scrub_known_ids(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [scrub_known_ids(v) for v in value]
+    return value
+
+
+def _anonymize_body(body: Any) -> Any:
+    if isinstance(body, dict):
+        return {k: anonymize_id(v) if k in ANONYMIZED_FIELDS and v is not None else _anonymize_body(v) for k, v in body.items()}
+    if isinstance(body, list):
+        return [_anonymize_body(v) for v in body]
+    return body
+
+
+class TraceWriter:
+    """Appends JSON lines to a gzip file from a background thread, so requests never block on disk."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._queue: queue.Queue = queue.Queue(maxsize=10000)
+        self.dropped = 0
+        threading.Thread(target=self._run, name="trace-writer", daemon=True).start()
+
+    def write(self, record: dict) -> None:
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        while True:
+            records = [self._queue.get()]
+            while not self._queue.empty() and len(records) < 500:
+                records.append(self._queue.get_nowait())
+            # Each batch becomes its own gzip member; readers see one continuous stream.
+            with gzip.open(self.path, "at", encoding="utf-8") as f:
+                for record in records:
+                    f.write(json.dumps(record, separators=(",", ":"), default=str) + "\n")
+
+
+def read_traces(path: str) -> list:
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class TrafficCaptureMiddleware:
+    """
+    ASGI middleware recording a sample of API requests for later replay.
+
+    Each record holds the offset from capture start (t), method (m), path (p),
+    query (q), JSON body (b), response status (s) and latency in ms (ms).
+    User ids are replaced by salted pseudonyms before anything hits disk.
+    """
+
+    def __init__(self, app, path: str, sample_rate: float = 1.0, path_prefix: str = "/api"):
+        self.app = app
+        self.writer = TraceWriter(path)
+        self.sample_rate = sample_rate
+        self.path_prefix = path_prefix
+        self.started = time.monotonic()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.path_prefix) or random.random() >= self.sample_rate:
+            return await self.app(scope, receive, send)
+
+        # Buffer the body up front so ids are pseudonymized before the handler
+        # runs; the Supabase recorder relies on that mapping being known.
+        chunks, more_body = [], True
+        while more_body:
+            message = await receive()
+            if message["type"] != "http.request":
+                break
+            chunks.append(message.get("body", b""))
+            more_body = message.get("more_body", False)
+        raw_body = b"".join(chunks)
+        record = self._record(scope, raw_body)
+        replayed = False
+
+        async def buffered_receive():
+            nonlocal replayed
+            if not replayed:
+                replayed = True
+                return {"type": "http.request", "body": raw_body, "more_body": False}
+            return await receive()
+
+        async def capture_send(message):
+            if message["type"] == "http.response.start":
+                record["s"] = message["status"]
+            await send(message)
+
+        start = time.monotonic()
+        try:
+            await self.app(scope, buffered_receive, capture_send)
+        finally:
+            record["ms"] = round((time.monotonic() - start) * 1000, 2)
+            self.writer.write(record)
+
+    def _record(self, scope, raw_body: bytes) -> dict:
+        query = [(k, anonymize_id(v) if k in ANONYMIZED_FIELDS else v)
+                 for k, v in parse_qsl(scope.get("query_string", b"").decode("latin-1"))]
+        body = None
+        if raw_body:
+            try:
+                body = _anonymize_body(json.loads(raw_body))
+            except ValueError:
+                body = None
+        return {
+            "t": round(time.monotonic() - self.started, 4),
+            "m": scope["method"],
+            "p": scope["path"],
+            "q": urlencode(query),
+            "b": body,
+            "s": 500,
+        }